@@ -11,10 +11,6 @@
 #
 # SPDX-License-Identifier: MIT
 import streamlit as st
-from src.ui.activity_overview_page import ActivityOverviewPage
-from src.ui.profile_page import ProfilePage
-from src.lib.athlete import Athlete
-from streamlit_option_menu import option_menu
 
 def Singleton(cls):
     instances = {}
@@ -32,9 +28,12 @@ def Singleton(cls):
 @Singleton
 class TrainingApp:
     # The constructor load all the activities in the gpx folder of the logged in user.
+    # Streamlit runs the script again at each interaction, the logged in user is kept in the session
+    # so that the athlete is loaded only once.
     def __init__(self):
         self.current_page = None
-        st.session_state.logged_in_user = None
+        if 'logged_in_user' not in st.session_state:
+            st.session_state.logged_in_user = None
 
     # Runs the TrainingApp and initializes the first page as ActivityOverviewPage.
     def run(self):
@@ -47,9 +46,13 @@ class TrainingApp:
         self.current_page = page
         self.current_page.render()
 
-    # Login the input username in the session
+    # Login the input username in the session. Nothing happens if the user is already logged in.
+    # The Athlete is imported here, on first use, to keep the application start fast.
     def login(self, username):
-        st.session_state.logged_in_user = Athlete(username)
+        athlete = st.session_state.logged_in_user
+        if athlete is None or athlete.get_username() != username:
+            from src.lib.athlete import Athlete
+            st.session_state.logged_in_user = Athlete(username)
         #self.session.login(username)
 
     # Logout the current user from the session
@@ -57,18 +60,31 @@ class TrainingApp:
         st.session_state.logged_in_user = None
         #self.session.logout()
 
-    # Create the sidebar menu with two options:
+    # Create the sidebar menu with four options:
     # - Activities, it shows all the athlete's activities
+    # - Summary, it shows the athlete's weekly, monthly and yearly totals
+    # - Heatmap, it shows the heatmap of the athlete's routes
     # - Profile, it shows the athlete's profile
+    # The menu component and the pages are imported when they are needed, only the selected page
+    # (and the libraries it uses) is loaded.
     def __create_sidebar_menu(self):
+        from streamlit_option_menu import option_menu
         with st.sidebar:
-            menu_choice = option_menu("Menu", ["Activities", 'Profile'], 
-                icons=['list', 'person'], menu_icon="cast", default_index=0)
+            menu_choice = option_menu("Menu", ["Activities", "Summary", "Heatmap", 'Profile'], 
+                icons=['list', 'bar-chart', 'map', 'person'], menu_icon="cast", default_index=0)
 
         # Select the page to show depending on the menu option the user selected
         if menu_choice == "Activities":
+            from src.ui.activity_overview_page import ActivityOverviewPage
             self.select_page(ActivityOverviewPage())
+        elif menu_choice == "Summary":
+            from src.ui.summary_page import SummaryPage
+            self.select_page(SummaryPage())
+        elif menu_choice == "Heatmap":
+            from src.ui.heatmap_page import HeatmapPage
+            self.select_page(HeatmapPage())
         elif menu_choice == "Profile":
+            from src.ui.profile_page import ProfilePage
             self.select_page(ProfilePage())
 
 if __name__ == "__main__":
@@ -0,0 +1,162 @@
+# Startup Benchmark - Measure the Cold Start of the CLI and the Streamlit Application
+#
+# This script measures, each time in a fresh Python process:
+# - the import time of main.py and of the Athlete module, and which heavy modules (pandas, gpxpy, numpy, ...)
+#   they load at import time
+# - the time to load an athlete with no cached summaries, rollup and best efforts (every GPX file parsed) and with
+#   a warm cache
+# - the time to first render of app.py with no cached files, if the installed Streamlit provides the AppTest API
+#
+# The athlete load and the render run on a temporary copy of the data folder, which is left untouched.
+#
+# Results are printed as JSON. With the --max-* options the script exits with status 1 if a measure exceeds
+# its limit, so it can be used to catch cold start regressions.
+#
+# Usage: python benchmarks/startup_benchmark.py [--username sasadangelo] [--repeat 5] [--max-import-seconds 0.3]
+#
+# Copyright (C) 2023 Salvatore D'Angelo
+# Maintainer: Salvatore D'Angelo sasadangelo@gmail.com
+#
+# This file is part of the Running Data Analysis project.
+#
+# SPDX-License-Identifier: MIT
+import os
+import sys
+import json
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+# The modules that must not be loaded just to start the application
+HEAVY_MODULES = ['pandas', 'numpy', 'gpxpy', 'pyarrow', 'tabulate']
+
+# Code run in a fresh process to measure the import time of a module
+IMPORT_SNIPPET = '''
+import sys, json, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{'seconds': elapsed, 'heavy_modules': [m for m in {heavy} if m in sys.modules]}}))
+'''
+
+# Code run in a fresh process to measure the time to load an athlete, imports included
+ATHLETE_SNIPPET = '''
+import json, time
+start = time.perf_counter()
+from src.lib.athlete import Athlete
+athlete = Athlete({username!r})
+print(json.dumps({{'seconds': time.perf_counter() - start, 'activities': len(athlete.get_activities())}}))
+'''
+
+# Code run in a fresh process to measure the time to first render of the Streamlit application
+RENDER_SNIPPET = '''
+import json, time
+from streamlit.testing.v1 import AppTest
+start = time.perf_counter()
+app = AppTest.from_file({app!r}, default_timeout=120)
+app.run()
+print(json.dumps({{'seconds': time.perf_counter() - start, 'exceptions': len(app.exception)}}))
+'''
+
+# Runs the snippet in a fresh Python process and returns the JSON object it prints.
+def run_snippet(snippet, cwd):
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    output = subprocess.run([sys.executable, '-c', snippet], cwd=cwd, env=env,
+                            capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+# Runs the snippet the input number of times and returns the result with the lowest time, the least
+# affected by the noise of the machine.
+def best_of(repeat, snippet, cwd, prepare=None):
+    results = []
+    for _ in range(repeat):
+        if prepare:
+            prepare()
+        results.append(run_snippet(snippet, cwd))
+    return min(results, key=lambda result: result['seconds'])
+
+def measure_imports(repeat):
+    return {module: best_of(repeat, IMPORT_SNIPPET.format(module=module, heavy=HEAVY_MODULES), ROOT)
+            for module in ['main', 'src.lib.athlete']}
+
+# The files and folders written in the athlete data folders by the application, removed for a cold start
+GENERATED_FILES = ['summaries.json', 'rollups.json', 'best_efforts.json', 'heatmap']
+
+# Copies the GPX files and the profiles of ROOT/data, without the generated files, in the data folder of the input
+# work folder. The benchmark never writes in ROOT/data.
+def copy_data(work_folder):
+    shutil.copytree(os.path.join(ROOT, 'data'), os.path.join(work_folder, 'data'),
+                    ignore=shutil.ignore_patterns(*GENERATED_FILES))
+
+# Removes the files generated by the application from the data folders of the input work folder.
+def clear_generated_files(work_folder):
+    data_folder = os.path.join(work_folder, 'data')
+    for username in os.listdir(data_folder):
+        for filename in GENERATED_FILES:
+            path = os.path.join(data_folder, username, filename)
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            elif os.path.exists(path):
+                os.remove(path)
+
+# Loads the athlete from a copy of the data folder, first with no generated files (every GPX file parsed) and then
+# with the files written by the first load.
+def measure_athlete(repeat, username):
+    with tempfile.TemporaryDirectory() as work_folder:
+        copy_data(work_folder)
+        snippet = ATHLETE_SNIPPET.format(username=username)
+        cold = best_of(repeat, snippet, work_folder, lambda: clear_generated_files(work_folder))
+        warm = best_of(repeat, snippet, work_folder)
+    return {'cold_cache': cold, 'warm_cache': warm}
+
+# Renders app.py on a copy of the data folder, with no generated files before each run.
+def measure_first_render(repeat):
+    with tempfile.TemporaryDirectory() as work_folder:
+        copy_data(work_folder)
+        try:
+            return best_of(repeat, RENDER_SNIPPET.format(app=os.path.join(ROOT, 'app.py')), work_folder,
+                           lambda: clear_generated_files(work_folder))
+        except subprocess.CalledProcessError as e:
+            # AppTest is available since Streamlit 1.28
+            return {'skipped': e.stderr.strip().splitlines()[-1] if e.stderr.strip() else 'failed'}
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure the cold start of the CLI and of the Streamlit application')
+    parser.add_argument('--username', default='sasadangelo', help='athlete loaded by the benchmark')
+    parser.add_argument('--repeat', type=int, default=5, help='number of runs of each measure, the best is reported')
+    parser.add_argument('--max-import-seconds', type=float, help='maximum import time of each module')
+    parser.add_argument('--max-warm-load-seconds', type=float, help='maximum athlete load time with a warm cache')
+    parser.add_argument('--max-render-seconds', type=float, help='maximum time to first render of the application with no cached files')
+    parser.add_argument('--no-heavy-imports', action='store_true',
+                        help=f"fail if importing a module loads any of: {', '.join(HEAVY_MODULES)}")
+    args = parser.parse_args()
+
+    results = {
+        'imports': measure_imports(args.repeat),
+        'athlete': measure_athlete(args.repeat, args.username),
+        'first_render': measure_first_render(args.repeat)
+    }
+    print(json.dumps(results, indent=2))
+
+    failures = []
+    for module, result in results['imports'].items():
+        if args.max_import_seconds is not None and result['seconds'] > args.max_import_seconds:
+            failures.append(f"import {module} took {result['seconds']:.3f}s")
+        if args.no_heavy_imports and result['heavy_modules']:
+            failures.append(f"import {module} loaded {', '.join(result['heavy_modules'])}")
+    warm_load = results['athlete']['warm_cache']['seconds']
+    if args.max_warm_load_seconds is not None and warm_load > args.max_warm_load_seconds:
+        failures.append(f"athlete load with warm cache took {warm_load:.3f}s")
+    render = results['first_render'].get('seconds')
+    if args.max_render_seconds is not None and render is not None and render > args.max_render_seconds:
+        failures.append(f"first render took {render:.3f}s")
+
+    for failure in failures:
+        print(f"Regression: {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
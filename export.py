@@ -0,0 +1,18 @@
+import argparse
+from src.lib.export import ActivityExporter, FORMATS
+
+# Exports the activities in the GPX folder to a columnar dataset partitioned by year and month.
+# Only the activities not exported yet are parsed and written.
+def main():
+    parser = argparse.ArgumentParser(description='Export running activities to a partitioned columnar dataset')
+    parser.add_argument('gpx_folder', help='folder containing the GPX files (e.g. data/<username>/gpx)')
+    parser.add_argument('output_folder', help='folder where the dataset is written')
+    parser.add_argument('--format', choices=list(FORMATS), default='arrow', help='dataset file format')
+    args = parser.parse_args()
+
+    exporter = ActivityExporter(args.output_folder, args.format)
+    exported = exporter.export_folder(args.gpx_folder)
+    print(f"Exported {exported} new activities to '{args.output_folder}'")
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,27 @@
 import os
-from tabulate import tabulate
-from datetime import datetime
+import re
+import sys
+import csv
+import json
+import argparse
+from datetime import datetime, date
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
 from src.lib.activity import Activity
+from src.lib.rollup import ActivityRollup, PERIODS
+from src.lib.dedup import ActivityDeduplicator, ActivityFingerprint, content_hash
+from src.lib.summary_cache import ActivitySummaryCache
+
+# Exit codes returned by the command
+EXIT_SUCCESS = 0        # all the activities have been processed
+EXIT_PARTIAL_FAILURE = 1  # some activities could not be processed or some paths have no GPX files
+EXIT_FAILURE = 3        # no activity could be processed or found (2 is used by argparse for usage errors)
+
+# GPX files exported by Garmin Connect are named activity_YYYYMMDD.gpx, the date in the name
+# allows to filter files without parsing them.
+FILENAME_DATE = re.compile(r'activity_(\d{8})')
+
+# The fields of each report row, the same names are used as CSV header and JSON keys.
+FIELDS = ['date', 'name', 'distance', 'duration', 'average_pace', 'average_heart_rate', 'elevation_gain', 'file']
 
 def seconds_to_mmss(seconds):
     minutes, seconds = divmod(seconds, 60)
@@ -12,29 +32,289 @@ def seconds_to_hhmmss(seconds):
     minutes, seconds = divmod(remainder, 60)
     return f'{int(hours):02d}:{int(minutes):02d}:{int(seconds):02d}'
 
-def main():
-    folder = 'gpx'
+# Parses a YYYY-MM-DD command line argument.
+def parse_date(value):
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid date '{value}', expected YYYY-MM-DD")
+
+# Returns the date in the activity_YYYYMMDD.gpx file name, or None if the name doesn't follow the pattern.
+def get_filename_date(file_path):
+    match = FILENAME_DATE.search(os.path.basename(file_path))
+    if match:
+        try:
+            return datetime.strptime(match.group(1), '%Y%m%d').date()
+        except ValueError:
+            pass
+    return None
+
+# Returns True if the date is in the [since, until] range. Missing limits are not checked.
+def in_range(day, since, until):
+    return (since is None or day >= since) and (until is None or day <= until)
+
+# Yields the GPX files found in the input paths. Paths can be files or folders, folders are searched
+# recursively. Files whose name contains a date outside the [since, until] range are skipped without
+# being parsed.
+def discover_files(paths, since, until):
+    for path in paths:
+        if os.path.isfile(path):
+            candidates = [path]
+        else:
+            candidates = (os.path.join(folder, filename)
+                          for folder, _, filenames in os.walk(path)
+                          for filename in sorted(filenames))
+        for file_path in candidates:
+            if not file_path.endswith('.gpx'):
+                continue
+            filename_date = get_filename_date(file_path)
+            if filename_date is not None and not in_range(filename_date, since, until):
+                continue
+            yield file_path
+
+# Returns True if the input path is a GPX file or a folder with at least one GPX file.
+def has_gpx_files(path):
+    if os.path.isfile(path):
+        return path.endswith('.gpx')
+    return any(filename.endswith('.gpx') for _, _, filenames in os.walk(path) for filename in filenames)
+
+# Parses the GPX file and returns the report row. This function runs in the worker processes,
+# errors are returned rather than raised so that a bad file doesn't stop the batch. If the chunk size
+# is set the file is processed in chunks with bounded memory (see ChunkedActivity).
+def parse_activity(file_path, chunk_size=None):
+    try:
+        if chunk_size:
+            # imported on first use, like tabulate below, to keep the command start fast
+            from src.lib.chunked_activity import ChunkedActivity
+            activity = ChunkedActivity(file_path, chunk_size)
+        else:
+            activity = Activity(file_path)
+        elevation_gain = activity.get_elevation_gain()
+        row = {
+            'date': activity.get_time().date(),
+            'name': activity.get_name(),
+            'distance': float(activity.get_distance()),
+            'duration': float(activity.get_duration()),
+            'average_pace': float(activity.get_average_pace()),
+            'average_heart_rate': activity.get_average_heart_rate(),
+            'elevation_gain': float(elevation_gain) if elevation_gain is not None else None,
+            'file': file_path
+        }
+        return row, None
+    except Exception as e:
+        return None, str(e)
+
+# Yields the (row, error) result of each file as soon as it is available. With more than one job files are
+# parsed in parallel by a pool of processes, at most a few files per worker are in flight at any time so
+# that memory doesn't grow with the number of files. Results are yielded in completion order.
+def parse_activities(file_paths, jobs, chunk_size=None):
+    if jobs == 1:
+        for file_path in file_paths:
+            yield parse_activity(file_path, chunk_size)
+        return
+
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        pending = set()
+        for file_path in file_paths:
+            pending.add(executor.submit(parse_activity, file_path, chunk_size))
+            if len(pending) >= jobs * 4:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        for future in pending:
+            yield future.result()
+
+# Report writer that prints a table at the end, rows must be buffered because the
+# column widths depend on all the rows.
+class TableWriter:
+    def __init__(self, output):
+        self.output = output
+        self.table_data = []
+
+    def write(self, row):
+        self.table_data.append([
+            row['date'].strftime('%Y-%m-%d'),
+            row['name'],
+            f"{row['distance']:.2f}",
+            seconds_to_hhmmss(row['duration']),
+            seconds_to_mmss(row['average_pace']),
+            row['average_heart_rate'],
+            f"{row['elevation_gain']:.1f}" if row['elevation_gain'] is not None else ''
+        ])
+
+    def close(self):
+        from tabulate import tabulate
+        self.table_data.sort(key=lambda row: row[0])
+        headers = ["Date", "Name", "Distance (Km)", "Duration", "Pace (min/Km)", "Avg HR", "Elev. Gain"]
+        print(tabulate(self.table_data, headers=headers), file=self.output)
+
+# Report writer that streams CSV rows as soon as they are available.
+class CsvWriter:
+    def __init__(self, output):
+        self.output = output
+        self.writer = csv.DictWriter(output, fieldnames=FIELDS)
+        self.writer.writeheader()
+
+    def write(self, row):
+        self.writer.writerow(dict(row, date=row['date'].isoformat()))
+        self.output.flush()
+
+    def close(self):
+        pass
 
+# Report writer that streams one JSON object per line as soon as it is available.
+class JsonLinesWriter:
+    def __init__(self, output):
+        self.output = output
+
+    def write(self, row):
+        self.output.write(json.dumps(dict(row, date=row['date'].isoformat())) + '\n')
+        self.output.flush()
+
+    def close(self):
+        pass
+
+WRITERS = {
+    'table': TableWriter,
+    'csv': CsvWriter,
+    'jsonl': JsonLinesWriter
+}
+
+# Prints the report of the activities in the input paths and returns the exit code.
+def print_activities(paths, since, until, jobs, format, chunk_size=None):
+    writer = WRITERS[format](sys.stdout)
+    processed = 0
+    failed = 0
+
+    for row, error in parse_activities(discover_files(paths, since, until), jobs, chunk_size):
+        if error is not None:
+            failed += 1
+            print(f"Error: {error}", file=sys.stderr)
+        else:
+            processed += 1
+            # Files without a date in the name can only be filtered once parsed
+            if in_range(row['date'], since, until):
+                writer.write(row)
+    writer.close()
+
+    return get_exit_code(processed, failed)
+
+# Prints the totals of the input period reading them from the rollup stored next to the first path, in its own file
+# because the rollup of the command can include other files and use another maximum heart rate than the Athlete one.
+# Like Athlete does at ingest, duplicate activities are counted once: the content hash and the fingerprint of each GPX
+# file are kept in a summary cache, so only the new or changed files are parsed. The removed files and the duplicates
+# are dropped from the rollup.
+def print_rollup(paths, period, max_heart_rate):
+    folder = os.path.dirname(os.path.abspath(paths[0]))
+    rollup_path = os.path.join(folder, 'report_rollups.json')
+    rollup = ActivityRollup.load(rollup_path, max_heart_rate)
+    summary_cache = ActivitySummaryCache(os.path.join(folder, 'report_summaries.json'))
+    deduplicator = ActivityDeduplicator()
+    failed = 0
+
+    # files are sorted by name, like Athlete does, so that among duplicates the same activity is always kept
+    file_paths = {os.path.basename(file_path): file_path for file_path in discover_files(paths, None, None)}
+    file_paths = dict(sorted(file_paths.items()))
+    for activity_id in rollup.get_activity_ids():
+        if activity_id not in file_paths:
+            rollup.remove_activity(activity_id)
+    summary_cache.retain(file_paths)
+    for activity_id, file_path in file_paths.items():
+        try:
+            summary = summary_cache.get(file_path)
+            # a file not in the cache is new or has changed since it was cached
+            changed = summary is None
+            summary = summary or {'hash': content_hash(file_path)}
+            original_id = deduplicator.find_exact(summary['hash'])
+            activity = None
+            if original_id is None:
+                if 'fingerprint' not in summary:
+                    activity = Activity(file_path)
+                    summary['fingerprint'] = ActivityFingerprint.from_activity(activity).to_json()
+                    summary_cache.put(file_path, summary)
+                fingerprint = ActivityFingerprint.from_json(summary['fingerprint'])
+                original_id = deduplicator.find_near(fingerprint)
+            elif changed:
+                summary_cache.put(file_path, summary)
+            if original_id is not None:
+                print(f"Skipping '{activity_id}': duplicate of '{original_id}'", file=sys.stderr)
+                rollup.remove_activity(activity_id)
+                continue
+            deduplicator.add(activity_id, summary['hash'], fingerprint)
+            if changed or not rollup.contains(activity_id):
+                rollup.add_activity(activity_id, activity or Activity(file_path))
+        except Exception as e:
+            failed += 1
+            print(f"Error: {str(e)}", file=sys.stderr)
+    summary_cache.save()
+    rollup.save(rollup_path)
+
+    from tabulate import tabulate
     table_data = []
-    headers = ["Date", "Name", "Distance (Km)", "Duration", "Pace (min/Km)", "Avg HR", "Elev. Gain"]
-
-    for filename in os.listdir(folder):
-        if filename.endswith('.gpx'):
-            file_path = os.path.join(folder, filename)
-            try:
-                activity = Activity(file_path)
-                table_data.append([
-                    activity.get_time().strftime('%Y-%m-%d'),  # Date (without time)
-                    activity.get_name(),
-                    f'{activity.get_distance():.2f}',
-                    seconds_to_hhmmss(activity.get_duration()),
-                    seconds_to_mmss(activity.get_average_pace()),
-                    activity.get_average_heart_rate(),
-                    f'{activity.get_elevation_gain():.1f}'
-                ])
-            except Exception as e:
-                print(f"Error: {str(e)}")
+    headers = ["Period", "Activities", "Distance (Km)", "Duration", "Elev. Gain", "Z1", "Z2", "Z3", "Z4", "Z5"]
+    for key, totals in rollup.get_buckets(period).items():
+        table_data.append([
+            key,
+            totals['count'],
+            f"{totals['distance']:.2f}",
+            seconds_to_hhmmss(totals['duration']),
+            f"{totals['elevation_gain']:.1f}"
+        ] + [seconds_to_hhmmss(seconds) for seconds in totals['zones']])
     print(tabulate(table_data, headers=headers))
 
+    return get_exit_code(len(rollup.get_activity_ids()), failed)
+
+# Summarizes the processing result in the command exit code.
+def get_exit_code(processed, failed):
+    if failed == 0:
+        return EXIT_SUCCESS
+    if processed == 0:
+        return EXIT_FAILURE
+    return EXIT_PARTIAL_FAILURE
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Running activities report',
+        epilog='Exit codes: 0 success, 1 some activities or paths failed, 2 usage error, 3 all activities failed '
+               'or no GPX files found.')
+    parser.add_argument('paths', nargs='*', default=['gpx'],
+                        help='GPX files or folders searched recursively (default: gpx)')
+    parser.add_argument('--since', type=parse_date, help='only activities on or after this date (YYYY-MM-DD)')
+    parser.add_argument('--until', type=parse_date, help='only activities on or before this date (YYYY-MM-DD)')
+    parser.add_argument('--jobs', '-j', type=int, default=os.cpu_count() or 1,
+                        help='number of files parsed in parallel (default: number of CPUs)')
+    parser.add_argument('--format', choices=list(WRITERS), default='table',
+                        help='output format, csv and jsonl rows are written as soon as they are available')
+    parser.add_argument('--chunk-size', type=int,
+                        help='process files in chunks of this many samples to bound memory on very long activities')
+    parser.add_argument('--rollup', choices=list(PERIODS), help='print the totals grouped by week, month or year')
+    parser.add_argument('--max-heart-rate', type=int, help='maximum heart rate used for the heart rate zones')
+    args = parser.parse_args()
+
+    if args.jobs < 1:
+        parser.error('--jobs must be at least 1')
+    if args.chunk_size is not None and args.chunk_size < 1:
+        parser.error('--chunk-size must be at least 1')
+
+    # a wrong or unmounted folder is an error, not an empty report
+    paths = []
+    for path in args.paths:
+        if not os.path.exists(path):
+            print(f"Error: '{path}' does not exist", file=sys.stderr)
+        elif not has_gpx_files(path):
+            print(f"Error: no GPX files in '{path}'", file=sys.stderr)
+        else:
+            paths.append(path)
+    if not paths:
+        return EXIT_FAILURE
+
+    if args.rollup:
+        exit_code = print_rollup(paths, args.rollup, args.max_heart_rate)
+    else:
+        exit_code = print_activities(paths, args.since, args.until, args.jobs, args.format, args.chunk_size)
+    if len(paths) < len(args.paths):
+        return max(exit_code, EXIT_PARTIAL_FAILURE)
+    return exit_code
+
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
@@ -10,9 +10,15 @@
 # This file is part of the Running Data Analysis project.
 #
 # SPDX-License-Identifier: MIT
-import gpxpy
-import pandas as pd
-from src.lib.elevation import CumulativeElevationCalculator
+
+# Lower limits of the heart rate zones Z2..Z5 as a fraction of the maximum heart rate.
+# Everything below the first limit belongs to Z1.
+HEART_RATE_ZONES = [0.6, 0.7, 0.8, 0.9]
+
+# Version of the algorithms computing the activity metrics. It is stored in the files of precomputed metrics (summary
+# cache, rollup and best efforts index), which are discarded and rebuilt from the GPX files when it changes.
+# Increase it whenever a change modifies the value of a persisted metric.
+METRICS_VERSION = 4
 
 # Represents a single running workout and manages associated data, including:
 # - Workout Duration
@@ -27,10 +33,15 @@ from src.lib.elevation import CumulativeElevationCalculator
 # - Elevation (if available)
 # - Heart Rate (if available)
 # - Cadence (if available)
-# 
+# - Track segment index
+# - Distance and elapsed time from the previous valid sample, and validity (see cleaning.py)
+#
+# The metrics are not computed when the activity is loaded: each getter computes only the requested metric and the
+# intermediate results it needs, memoized for the following requests (see metrics.py).
+#
 # This class is designed to handle and analyze individual running activities.
 class Activity:
-    def __init__(self, file_path):
+    def __init__(self, file_path, elevation_calculator=None, cleaner=None):
         # Initialize the file path for the GPX file
         self.file_path = file_path
         # The activity_data attribute contains a tabular DataFrame with columns for latitude, longitude, time, 
@@ -40,42 +51,42 @@ class Activity:
         # to the presence of data in the GPX file, including optional hr and cadence information.
         self.activity_data = None
         
-        # Initialize attributes for various activity metrics
-        self.time = None
+        # Initialize the attributes read from the GPX file, the metrics are computed on demand by self.metrics
         self.name = None
         self.description = None
-        self.duration = None
-        self.distance = None
-        self.average_pace = None
-        self.average_heart_rate = None
-        self.max_heart_rate = None
-        self.elevation_gain = None
-        self.elevation_loss = None
-        self.average_cadence = None
-        self.max_cadence = None
+        self.cleaning_report = None
+
+        # gpxpy, pandas and numpy (through elevation.py) are imported the first time an activity is parsed rather
+        # than when this module is imported, so that the application starts without loading them when the
+        # activity summaries are already cached.
+        import gpxpy
+        import pandas as pd
+        from src.lib.elevation import CumulativeElevationCalculator
+        from src.lib.cleaning import ActivityCleaner
+        from src.lib.metrics import ActivityMetrics
 
         # Initialize an elevation calculator with the default CumulativeElevationCalculator
         # Various elevation gain and loss calculation strategies are available in elevation.py
-        # Programmers can choose different techniques by using alternative classes from that file
-        elevation_calculator = CumulativeElevationCalculator()
+        # Programmers can choose different techniques by passing alternative classes from that file
+        self.elevation_calculator = elevation_calculator or CumulativeElevationCalculator()
+        # The data samples are cleaned right after parsing, by default with all the fixes enabled.
+        # Pass an ActivityCleaner with the fixes disabled to compute the metrics on the raw samples.
+        self.cleaner = cleaner or ActivityCleaner()
 
         try:
             # Open and parse the GPX file
             with open(file_path, 'r') as gpx_file:
                 gpx = gpxpy.parse(gpx_file)
 
-            # Extract key metrics for the workout, including activity type, duration, distance, and average pace
             self.activity_type = gpx.link_type
-            self.duration = gpx.get_duration()
-            self.distance = gpx.length_3d() / 1000
-            self.average_pace = self.duration / self.distance
- 
+
             # The goal with this piece of code is to create a DataFrame containing essential columns like longitude, 
             # latitude, and time. Optionally, if available in the GPX file, columns for elevation, cadence, and HR are 
             # added. Since DataFrames don't support dynamic column addition, we construct a list of data points
             # containing only available data. Finally, we convert the list of objects into a DataFrame,
             # resulting in a tabular data structure with only the available columns.
             activity_data = []
+            segment_index = 0
             for track in gpx.tracks:
                 self.name = track.name
                 self.description = track.description
@@ -84,7 +95,8 @@ class Activity:
                         data_point = {
                             'latitude': point.latitude,
                             'longitude': point.longitude,
-                            'time': point.time
+                            'time': point.time,
+                            'segment': segment_index
                         }
                         if point.has_elevation():
                             data_point['elevation'] = point.elevation
@@ -93,29 +105,14 @@ class Activity:
                             data_point['cadence'] = int(point.extensions[0][1].text) * 2
 
                         activity_data.append(data_point)
+                    segment_index += 1
             self.activity_data = pd.DataFrame(activity_data)
 
-            # The self.time attribute stores the timestamp of the initial data point captured during the 
-            # workout session. This timestamp represents the starting time of the activity, as recorded in the 
-            # GPX file. It is the time at which the workout session commenced.            
-            self.time = self.activity_data['time'].iloc[0]
-
-            # Once the activity_data DataFrame is available, computing average and maximum values for
-            # 'hr' (heart rate) and 'cadence' becomes straightforward. We use the mean() and max() functions
-            # provided by DataFrames to calculate the average and maximum values for these columns.
-            if not self.activity_data.empty:
-                if 'hr' in self.activity_data.columns:
-                    self.average_heart_rate = int(round(self.activity_data['hr'].mean()))
-                    self.max_heart_rate = self.activity_data['hr'].max()
-                if 'cadence' in self.activity_data.columns:
-                    self.average_cadence = int(round(self.activity_data['cadence'].mean()))
-                    self.max_cadence = self.activity_data['cadence'].max()
-
-            # To calculate elevation gain and loss, we first extract the 'elevation' column from the activity_data DataFrame.
-            # Then, we remove rows with missing elevation data using dropna(). Finally, we calculate elevation gain and loss
-            # using the selected elevation calculator strategy (elevation_calculator.calculate()).
-            elevation_data = self.activity_data[['elevation']].dropna()
-            self.elevation_gain, self.elevation_loss = elevation_calculator.calculate(elevation_data)
+            # The cleaner fixes the recording errors in place and adds the distance, elapsed and valid columns.
+            self.cleaning_report = self.cleaner.clean(self.activity_data)
+
+            # The metrics of the activity, computed on the cleaned samples when they are requested
+            self.metrics = ActivityMetrics(self)
 
         except Exception as e:
             # Raise an exception if there's an error while reading the GPX file
@@ -123,7 +120,7 @@ class Activity:
 
     # Get the date and time of the activity.
     def get_time(self):
-        return self.time
+        return self.metrics.get('time')
 
     # Get the name or description of the activity.
     def get_name(self):
@@ -133,46 +130,80 @@ class Activity:
     def get_description(self):
         return self.description
 
-    # Get the raw data for the activity.
+    # Get the data samples of the activity, cleaned by the activity cleaner. Invalid samples are kept and
+    # marked in the 'valid' column.
     def get_activity_data(self):
         return self.activity_data
+
+    # Get the report of the fixes made by the activity cleaner: fixed samples for each kind of error.
+    def get_cleaning_report(self):
+        return self.cleaning_report
+
+    # Get the input metrics (see metrics.py) as a name -> value dictionary. Only the requested metrics and the
+    # intermediate results they depend on are computed, each one once.
+    def get_metrics(self, names):
+        return self.metrics.compute(names)
     
     # Get the duration of the activity in seconds.
     def get_duration(self):
-        return self.duration
+        return self.metrics.get('duration')
 
     # Get the distance covered during the activity in kilometers.
     def get_distance(self):
-        return self.distance
+        return self.metrics.get('distance')
 
     # Get the average pace of the activity in minutes per kilometer.
     def get_average_pace(self):
-        return self.average_pace
+        return self.metrics.get('average_pace')
 
     # Get the average heart rate during the activity.
     def get_average_heart_rate(self):
-        return self.average_heart_rate
+        return self.metrics.get('average_heart_rate')
 
     # Get the maximum heart rate during the activity.
     def get_max_heart_rate(self):
-        return self.max_heart_rate
+        return self.metrics.get('max_heart_rate')
 
     # Get the average cadence (steps per minute) during the activity.
     def get_average_cadence(self):
-        return self.average_cadence
+        return self.metrics.get('average_cadence')
 
     # Get the maximum cadence (steps per minute) during the activity.
     def get_max_cadence(self):
-        return self.max_cadence
+        return self.metrics.get('max_cadence')
 
     # Get the elevation gain during the activity.
     def get_elevation_gain(self):
-        return self.elevation_gain
+        return self.metrics.get('elevation_gain')
 
     # Get the elevation loss during the activity.
     def get_elevation_loss(self):
-        return self.elevation_loss
-
-    # Set the elevation calculator used for elevation calculations.
+        return self.metrics.get('elevation_loss')
+
+    # Get the seconds spent in each heart rate zone during the activity. Zones are defined as a percentage
+    # of the input maximum heart rate: Z1 below 60%, Z2 60-70%, Z3 70-80%, Z4 80-90% and Z5 above 90%.
+    # Each sample is weighted with the time elapsed since the previous valid sample (0 for invalid samples).
+    # If the GPX file contains no heart rate data all the zones are zero.
+    def get_time_in_zones(self, max_heart_rate):
+        zones = self.metrics.get('time_in_zones', {'max_heart_rate': max_heart_rate})
+        return zones if zones is not None else [0] * (len(HEART_RATE_ZONES) + 1)
+
+    # Get the best efforts of the activity: for each of the input distances (name -> meters) the shortest time in
+    # seconds needed to cover it, or None if the activity is shorter. The distance comes from the cleaned distance
+    # column, so GPS jumps are not counted, and invalid samples keep the time of the previous valid one.
+    #
+    # GPS drift can be slower than the jumps removed by the cleaner but still much faster than the athlete. If
+    # max_speed_ratio is given, the moves between two samples faster than max_speed_ratio times the median speed of
+    # the activity (weighted by time) are not counted in the distance of the efforts.
+    def get_best_efforts(self, distances, max_speed_ratio=None):
+        return self.metrics.get('best_efforts', {'distances': distances, 'max_speed_ratio': max_speed_ratio})
+
+    # Get the elevation calculator used for elevation calculations.
+    def get_elevation_calculator(self):
+        return self.elevation_calculator
+
+    # Set the elevation calculator used for elevation calculations, elevation gain and loss will be recalculated
+    # the next time they are requested.
     def set_elevation_calculator(self, elevation_calculator):
         self.elevation_calculator = elevation_calculator
+        self.metrics.invalidate(['elevation'])
@@ -11,7 +11,18 @@
 # SPDX-License-Identifier: MIT
 import os
 import csv
+from bisect import bisect_left
+from datetime import date
 from src.lib.activity import Activity
+from src.lib.rollup import ActivityRollup
+from src.lib.best_efforts import BestEffortIndex, RacePredictor
+from src.lib.dedup import ActivityDeduplicator, ActivityFingerprint, content_hash
+from src.lib.summary_cache import ActivitySummaryCache
+
+# The metrics of the activity overview rows. When a new or changed GPX file is loaded, the activity is also
+# fingerprinted for the deduplication and added to the rollup (time_in_zones) and the best efforts index
+# (best_efforts), so the metrics not computed for it are the elevation loss, the maximum heart rate and the cadence.
+OVERVIEW_METRICS = ['time', 'distance', 'duration', 'average_pace', 'average_heart_rate', 'elevation_gain']
 
 # This class which is responsible for managing an athlete's profile
 # information and activities. It loads and stores the athlete's profile data from a profile.csv file,
@@ -27,8 +38,17 @@ class Athlete:
         self.gender = None
         self.location = None
         self.bio = None
+        # The activities skipped at ingest because duplicates of other ones: activity id -> (original id, reason)
+        self.duplicates = {}
+        # The GPX files of the loaded activities, duplicates excluded
+        self.activity_files = []
+        self.deduplicator = ActivityDeduplicator()
         self.__load_profile(username)
+        self.rollup = ActivityRollup.load(self.__get_rollup_path(), self.get_max_heart_rate())
+        self.best_efforts = BestEffortIndex.load(self.__get_best_efforts_path())
+        self.summary_cache = ActivitySummaryCache(os.path.join("data", self.username, 'summaries.json'))
         self.activities = self.__load_activities()
+        self.__save()
 
     # This method loads the profile information from the file data/<username>/profile.csv
     def __load_profile(self, username):
@@ -49,30 +69,156 @@ class Athlete:
     def __load_activities(self):
         activities_data = []
         activities_folder = os.path.join("data", self.username, 'gpx')
+        # files are sorted so that, among duplicates, the same activity is always kept
+        filenames = sorted(filename for filename in os.listdir(activities_folder) if filename.endswith('.gpx'))
+
+        # the activities whose GPX file has been removed are removed from the rollup and the best efforts too
+        for activity_id in self.rollup.get_activity_ids():
+            if activity_id not in filenames:
+                self.rollup.remove_activity(activity_id)
+        for activity_id in self.best_efforts.get_activity_ids():
+            if activity_id not in filenames:
+                self.best_efforts.remove_activity(activity_id)
 
-        # for each file in the gpx folder an Activity object is created
-        # and added to the activities_data list that will be returned in output
-        for filename in os.listdir(activities_folder):
-            if filename.endswith('.gpx'):
-                file_path = os.path.join(activities_folder, filename)
-                try:
+        # for each file in the gpx folder the summary of the activity (content hash, fingerprint and overview row)
+        # is added to the activities_data list that will be returned in output. Summaries are read from the cache,
+        # a GPX file is parsed only if it is new or it has changed since it was cached.
+        self.summary_cache.retain(filenames)
+        for filename in filenames:
+            file_path = os.path.join(activities_folder, filename)
+            try:
+                summary = self.summary_cache.get(file_path)
+                # a file not in the cache is new or has changed since it was cached
+                changed = summary is None
+                summary = summary or {'hash': content_hash(file_path)}
+                # exact duplicates are detected from the file content without parsing the file
+                original_id = self.deduplicator.find_exact(summary['hash'])
+                if original_id is not None:
+                    self.summary_cache.put(file_path, summary)
+                    self.__skip_duplicate(filename, original_id, 'exact')
+                    continue
+                activity = None
+                if 'row' not in summary:
                     # load the activity from the GPX file
                     activity = Activity(file_path)
-                    # append the activity to the list of the athlete activities
-                    activities_data.append([
-                        activity.get_time(),  # Date (without time)
-                        activity.get_name(),
-                        f'{activity.get_distance():.2f}',
-                        self.__seconds_to_hhmmss(activity.get_duration()),
-                        self.__seconds_to_mmss(activity.get_average_pace()),
-                        activity.get_average_heart_rate(),
-                        f'{activity.get_elevation_gain():.1f}'
-                    ])
-                except Exception as e:
-                    print(f"Error: {str(e)}")
+                    summary['fingerprint'] = ActivityFingerprint.from_activity(activity).to_json()
+                    summary['row'] = self.__create_row(activity)
+                    self.summary_cache.put(file_path, summary)
+                # near duplicates are detected from the activity fingerprint
+                fingerprint = ActivityFingerprint.from_json(summary['fingerprint'])
+                original_id = self.deduplicator.find_near(fingerprint)
+                if original_id is not None:
+                    self.__skip_duplicate(filename, original_id, 'near')
+                    continue
+                self.deduplicator.add(filename, summary['hash'], fingerprint)
+                # only the activities changed or not yet in the rollup or in the best efforts are added to them
+                # (replacing the previous version), the GPX file is parsed at most once for both
+                if changed or not self.rollup.contains(filename):
+                    activity = activity or Activity(file_path)
+                    self.rollup.add_activity(filename, activity)
+                if changed or not self.best_efforts.contains(filename):
+                    activity = activity or Activity(file_path)
+                    self.best_efforts.add_activity(filename, activity)
+                # append the activity to the list of the athlete activities
+                activities_data.append(summary['row'])
+                self.activity_files.append(file_path)
+            except Exception as e:
+                print(f"Error: {str(e)}")
     
         return activities_data
 
+    # Creates the overview row of the activity.
+    def __create_row(self, activity):
+        metrics = activity.get_metrics(OVERVIEW_METRICS)
+        elevation_gain = metrics['elevation_gain']
+        return [
+            metrics['time'].isoformat(),  # Date (without time)
+            activity.get_name(),
+            f'{metrics["distance"]:.2f}',
+            self.__seconds_to_hhmmss(metrics['duration']),
+            self.__seconds_to_mmss(metrics['average_pace']),
+            metrics['average_heart_rate'],
+            f'{elevation_gain:.1f}' if elevation_gain is not None else None
+        ]
+
+    # Records that the activity is a duplicate of another one and makes sure it isn't counted in the rollup
+    # and in the best efforts.
+    def __skip_duplicate(self, activity_id, original_id, reason):
+        print(f"Skipping '{activity_id}': {reason} duplicate of '{original_id}'")
+        self.duplicates[activity_id] = (original_id, reason)
+        self.rollup.remove_activity(activity_id)
+        self.best_efforts.remove_activity(activity_id)
+
+    # Adds the activity stored in the input GPX file of the data/<username>/gpx folder to the athlete activities,
+    # rollup and best efforts and persists them with its summary. If an activity with the same id is already present
+    # it is replaced. Returns False if the activity is a duplicate of an existing one and it has not been added.
+    def add_activity(self, file_path):
+        activity_id = os.path.basename(file_path)
+        self.__forget_activity(activity_id)
+        summary = {'hash': content_hash(file_path)}
+        original_id = self.deduplicator.find_exact(summary['hash'])
+        if original_id is not None:
+            self.summary_cache.put(file_path, summary)
+            self.__skip_duplicate(activity_id, original_id, 'exact')
+            self.__save()
+            return False
+        activity = Activity(file_path)
+        fingerprint = ActivityFingerprint.from_activity(activity)
+        summary['fingerprint'] = fingerprint.to_json()
+        summary['row'] = self.__create_row(activity)
+        self.summary_cache.put(file_path, summary)
+        original_id = self.deduplicator.find_near(fingerprint)
+        if original_id is not None:
+            self.__skip_duplicate(activity_id, original_id, 'near')
+            self.__save()
+            return False
+        self.deduplicator.add(activity_id, summary['hash'], fingerprint)
+        self.rollup.add_activity(activity_id, activity)
+        self.best_efforts.add_activity(activity_id, activity)
+        # the activities are kept in file name order, like when they are loaded
+        index = bisect_left([os.path.basename(path) for path in self.activity_files], activity_id)
+        self.activities.insert(index, summary['row'])
+        self.activity_files.insert(index, file_path)
+        self.__save()
+        return True
+
+    # Removes the activity stored in the input GPX file from the athlete activities, rollup, best efforts and
+    # summaries and persists them. The activities skipped as duplicates of it are added in its place.
+    def remove_activity(self, file_path):
+        activity_id = os.path.basename(file_path)
+        self.__forget_activity(activity_id)
+        self.summary_cache.remove(file_path)
+        for duplicate_id, (original_id, _) in list(self.duplicates.items()):
+            if original_id == activity_id:
+                self.add_activity(os.path.join(os.path.dirname(file_path), duplicate_id))
+        self.__save()
+
+    # Removes the activity with the input id from the athlete activities, deduplicator, rollup and best efforts.
+    def __forget_activity(self, activity_id):
+        self.deduplicator.remove(activity_id)
+        self.duplicates.pop(activity_id, None)
+        self.rollup.remove_activity(activity_id)
+        self.best_efforts.remove_activity(activity_id)
+        for index, path in enumerate(self.activity_files):
+            if os.path.basename(path) == activity_id:
+                del self.activities[index]
+                del self.activity_files[index]
+                break
+
+    # Persists the summaries, the rollup and the best efforts.
+    def __save(self):
+        self.summary_cache.save()
+        self.rollup.save(self.__get_rollup_path())
+        self.best_efforts.save(self.__get_best_efforts_path())
+
+    # Returns the path of the file data/<username>/rollups.json where the rollup is persisted.
+    def __get_rollup_path(self):
+        return os.path.join("data", self.username, 'rollups.json')
+
+    # Returns the path of the file data/<username>/best_efforts.json where the best efforts index is persisted.
+    def __get_best_efforts_path(self):
+        return os.path.join("data", self.username, 'best_efforts.json')
+
     # Converts seconds to the 'HH:MM:SS' format.
     def __seconds_to_hhmmss(self, seconds):
         hours, remainder = divmod(seconds, 3600)
@@ -109,6 +255,37 @@ class Athlete:
     def get_bio(self):
         return self.bio
 
+    # Returns the paths of the GPX files of the athlete activities, duplicates excluded.
+    def get_activity_files(self):
+        return self.activity_files
+
+    # Returns the activities skipped because duplicates: activity id -> (original activity id, 'exact' or 'near').
+    def get_duplicates(self):
+        return self.duplicates
+
+    # Returns the pre-aggregated weekly, monthly and yearly totals of the athlete activities.
+    def get_rollup(self):
+        return self.rollup
+
+    # Returns the index of the personal bests of the athlete for each standard distance.
+    def get_best_efforts(self):
+        return self.best_efforts
+
+    # Returns the race time predictor fitted from the best efforts of the last 90 days (as of the input datetime,
+    # default now), or from the all-time best efforts if there are no activities in that period.
+    def get_race_predictor(self, as_of=None):
+        bests = self.best_efforts.get_rolling_bests(as_of) or self.best_efforts.get_all_time_bests()
+        return RacePredictor(bests)
+
+    # Returns the estimated maximum heart rate (220 - age), or None if the birth date is unknown.
+    def get_max_heart_rate(self):
+        if not self.birth_date:
+            return None
+        birth_date = date.fromisoformat(self.birth_date)
+        today = date.today()
+        age = today.year - birth_date.year - ((today.month, today.day) < (birth_date.month, birth_date.day))
+        return 220 - age
+
 
 
 
@@ -0,0 +1,217 @@
+# Best Efforts - Personal Bests Index and Race Time Predictor
+#
+# This module defines the BestEffortIndex class, which maintains the athlete's personal bests for each standard
+# distance, and the RacePredictor class, which predicts race times from them with the Riegel formula and the
+# critical speed model.
+#
+# Copyright (C) 2023 Salvatore D'Angelo
+# Maintainer: Salvatore D'Angelo sasadangelo@gmail.com
+#
+# This file is part of the Running Data Analysis project.
+#
+# SPDX-License-Identifier: MIT
+import os
+import json
+import math
+from bisect import bisect_left, insort
+from datetime import datetime, timedelta, timezone
+from src.lib.activity import METRICS_VERSION
+
+# The standard distances in meters, from the shortest to the longest.
+STANDARD_DISTANCES = {
+    '400m': 400,
+    '1K': 1000,
+    '1 Mile': 1609.344,
+    '5K': 5000,
+    '10K': 10000,
+    'Half Marathon': 21097.5,
+    'Marathon': 42195,
+}
+
+# The number of days of the rolling window of the current bests
+ROLLING_DAYS = 90
+
+# Efforts faster than this speed in meters per second are not humanly possible, they are GPS errors
+MAX_SPEED = 10.5
+
+# Moves between two samples faster than this ratio of the median speed of the activity are considered GPS drift and
+# are not counted in the best efforts (see Activity.get_best_efforts). It leaves room for intervals and finishing
+# sprints in easy runs, while a runner at 8:00/km can't cover a sample at 3:00/km or faster.
+MAX_SPEED_RATIO = 3.0
+
+# The Riegel fatigue exponent
+RIEGEL_EXPONENT = 1.06
+
+# The range in seconds of the efforts used to fit the critical speed model. Shorter efforts are mostly anaerobic,
+# longer ones are affected by fatigue and fueling, in both cases the model doesn't hold.
+CRITICAL_SPEED_RANGE = (120, 1800)
+
+# This class maintains the best efforts of the athlete activities for each standard distance. The best efforts of
+# each activity (see Activity.get_best_efforts) are added incrementally, so the all-time and the rolling best for a
+# distance are read from the index without loading any Activity.
+#
+# For each distance the efforts are kept sorted by activity time: the all-time best is updated when an activity is
+# added, the best in a time window is the minimum of the efforts found with a binary search on the time.
+#
+# The index can be persisted to a JSON file and reloaded later.
+class BestEffortIndex:
+    def __init__(self, distances=STANDARD_DISTANCES):
+        self.distances = distances
+        # The UTC start time of each activity, keyed by activity id
+        self.activities = {}
+        # The efforts of each distance sorted by time: distance name -> list of [time, seconds, activity id]
+        self.efforts = {name: [] for name in distances}
+        # The all-time best effort of each distance: distance name -> [time, seconds, activity id] or None
+        self.all_time = {name: None for name in distances}
+
+    # Loads the index from the input JSON file. If the file does not exist an empty index is returned.
+    @classmethod
+    def load(cls, index_path, distances=STANDARD_DISTANCES):
+        index = cls(distances)
+        if os.path.exists(index_path):
+            with open(index_path, 'r') as index_file:
+                data = json.load(index_file)
+            # efforts computed for different distances or with a different METRICS_VERSION are discarded,
+            # they will be rebuilt from the activities
+            if data.get('version') == METRICS_VERSION and data.get('distances') == distances:
+                index.activities = data['activities']
+                index.efforts = data['efforts']
+                for name in distances:
+                    index.__update_all_time(name)
+        return index
+
+    # Saves the index to the input JSON file.
+    def save(self, index_path):
+        data = {
+            'version': METRICS_VERSION,
+            'distances': self.distances,
+            'activities': self.activities,
+            'efforts': self.efforts
+        }
+        with open(index_path, 'w') as index_file:
+            json.dump(data, index_file)
+
+    # Returns True if the activity with the input id is already part of the index.
+    def contains(self, activity_id):
+        return activity_id in self.activities
+
+    # Returns the ids of all the activities that are part of the index.
+    def get_activity_ids(self):
+        return list(self.activities.keys())
+
+    # Adds the best efforts of the activity to the index. If an activity with the same id is already present
+    # it is replaced.
+    def add_activity(self, activity_id, activity):
+        if activity_id in self.activities:
+            self.remove_activity(activity_id)
+
+        time = activity.get_time().astimezone(timezone.utc).isoformat()
+        self.activities[activity_id] = time
+        for name, seconds in activity.get_best_efforts(self.distances, MAX_SPEED_RATIO).items():
+            if seconds is None or seconds <= 0 or self.distances[name] / seconds > MAX_SPEED:
+                continue
+            effort = [time, seconds, activity_id]
+            insort(self.efforts[name], effort)
+            best = self.all_time[name]
+            if best is None or seconds < best[1]:
+                self.all_time[name] = effort
+
+    # Removes the activity with the input id from the index. Nothing happens if it is not present.
+    def remove_activity(self, activity_id):
+        if self.activities.pop(activity_id, None) is None:
+            return
+        for name, efforts in self.efforts.items():
+            efforts[:] = [effort for effort in efforts if effort[2] != activity_id]
+            best = self.all_time[name]
+            if best is not None and best[2] == activity_id:
+                self.__update_all_time(name)
+
+    # Returns the all-time best effort of the input distance as a [time, seconds, activity id] list,
+    # or None if no activity covered it.
+    def get_all_time_best(self, name):
+        return self.all_time[name]
+
+    # Returns the best effort of the input distance in the ROLLING_DAYS days before the input datetime (default now)
+    # as a [time, seconds, activity id] list, or None if no activity covered it in that period.
+    def get_rolling_best(self, name, as_of=None, days=ROLLING_DAYS):
+        as_of = (as_of or datetime.now(timezone.utc)).astimezone(timezone.utc)
+        efforts = self.efforts[name]
+        start = bisect_left(efforts, [(as_of - timedelta(days=days)).isoformat()])
+        end = bisect_left(efforts, [as_of.isoformat(), math.inf])
+        window = efforts[start:end]
+        return min(window, key=lambda effort: effort[1]) if window else None
+
+    # Returns the all-time bests of all the distances as a distance name -> seconds dictionary.
+    def get_all_time_bests(self):
+        return {name: best[1] for name, best in self.all_time.items() if best is not None}
+
+    # Returns the rolling bests of all the distances as a distance name -> seconds dictionary.
+    def get_rolling_bests(self, as_of=None, days=ROLLING_DAYS):
+        bests = {name: self.get_rolling_best(name, as_of, days) for name in self.distances}
+        return {name: best[1] for name, best in bests.items() if best is not None}
+
+    # Returns the progression of the personal best of the input distance: the efforts that improved
+    # the best at the time they were done, as a list of [time, seconds, activity id] sorted by time.
+    def get_progression(self, name):
+        progression = []
+        for effort in self.efforts[name]:
+            if not progression or effort[1] < progression[-1][1]:
+                progression.append(effort)
+        return progression
+
+    def __update_all_time(self, name):
+        efforts = self.efforts[name]
+        self.all_time[name] = min(efforts, key=lambda effort: effort[1]) if efforts else None
+
+# This class predicts race times from the best efforts of the athlete (distance name -> seconds) with two models:
+#
+# - Riegel: T2 = T1 * (D2 / D1) ^ 1.06, where T1 is the best effort on the distance D1 closest to D2 (D2 itself if
+#   there is a best effort on it).
+# - Critical speed: D = CS * T + D', a linear fit of distance over time of the efforts lasting from 2 to 30
+#   minutes, where CS is the critical speed and D' the distance that can be covered above it.
+class RacePredictor:
+    def __init__(self, bests, distances=STANDARD_DISTANCES):
+        self.distances = distances
+        self.bests = {name: seconds for name, seconds in bests.items() if name in distances}
+        self.critical_speed, self.d_prime = self.__fit_critical_speed()
+
+    # Returns the Riegel prediction in seconds for the input distance, from the best effort on the closest
+    # distance, or None if there are no best efforts. If there is a best effort on the distance itself it is the
+    # prediction, a best on another distance would predict a time slower than the one already run.
+    def predict_riegel(self, name):
+        distance = self.distances[name]
+        if not self.bests:
+            return None
+        reference = min(self.bests, key=lambda reference: abs(math.log(self.distances[reference] / distance)))
+        return self.bests[reference] * (distance / self.distances[reference]) ** RIEGEL_EXPONENT
+
+    # Returns the critical speed prediction in seconds for the input distance, or None if the model can't be
+    # fitted or the distance is too short for it.
+    def predict_critical_speed(self, name):
+        if self.critical_speed is None:
+            return None
+        distance = self.distances[name]
+        if distance <= self.d_prime:
+            return None
+        return (distance - self.d_prime) / self.critical_speed
+
+    # Returns the critical speed in meters per second and D' in meters, or (None, None) if there are less than two
+    # efforts in the CRITICAL_SPEED_RANGE or the fit is not physiologically meaningful.
+    def get_critical_speed(self):
+        return self.critical_speed, self.d_prime
+
+    def __fit_critical_speed(self):
+        points = [(seconds, self.distances[name]) for name, seconds in self.bests.items()
+                  if CRITICAL_SPEED_RANGE[0] <= seconds <= CRITICAL_SPEED_RANGE[1]]
+        if len(points) < 2:
+            return None, None
+        mean_time = sum(time for time, _ in points) / len(points)
+        mean_distance = sum(distance for _, distance in points) / len(points)
+        variance = sum((time - mean_time) ** 2 for time, _ in points)
+        if variance == 0:
+            return None, None
+        critical_speed = sum((time - mean_time) * (distance - mean_distance) for time, distance in points) / variance
+        d_prime = mean_distance - critical_speed * mean_time
+        if critical_speed <= 0 or d_prime < 0:
+            return None, None
+        return critical_speed, d_prime
@@ -0,0 +1,390 @@
+# ChunkedActivity - Bounded-memory Processing of Long Running Workouts
+#
+# This module defines the ChunkedActivity class, which computes the summary metrics of a running workout
+# reading the GPX file in fixed-size chunks of data samples. It is meant for very long activities (multi-day
+# ultras, 24 hour events recorded at 1 Hz) where keeping the whole GPX tree and data stream in memory, like
+# Activity does, is too expensive.
+#
+# Copyright (C) 2023 Salvatore D'Angelo
+# Maintainer: Salvatore D'Angelo sasadangelo@gmail.com
+#
+# This file is part of the Running Data Analysis project.
+#
+# SPDX-License-Identifier: MIT
+import xml.etree.ElementTree as ET
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from src.lib.cleaning import ActivityCleaner, REPORT_KEYS, TIME_WINDOW
+
+# The default number of data samples in each chunk
+DEFAULT_CHUNK_SIZE = 10000
+
+# The columns of each chunk. Optional data not present in a sample is NaN.
+COLUMNS = ['latitude', 'longitude', 'time', 'elevation', 'hr', 'cadence']
+
+# Returns the local name of an XML tag, without the namespace (e.g. '{http://...}trkpt' -> 'trkpt').
+def _local_name(tag):
+    return tag.rsplit('}', 1)[-1]
+
+# Reads the data samples of a GPX file in chunks without building the whole document tree. Each processed trackpoint
+# is removed from the tree, so memory usage depends on the chunk size and not on the length of the activity.
+# Chunks never span two track segments, because distance and duration are calculated per segment.
+class GPXChunkReader:
+    def __init__(self, file_path, chunk_size=DEFAULT_CHUNK_SIZE):
+        self.file_path = file_path
+        self.chunk_size = chunk_size
+        self.name = None
+        self.description = None
+
+    # Yields (chunk, segment_start) tuples, where chunk is a DataFrame with the COLUMNS and segment_start is True
+    # if the chunk is the first one of a track segment.
+    def read(self):
+        samples = []
+        segment_start = True
+        segment = None
+        path = []
+
+        for event, element in ET.iterparse(self.file_path, events=('start', 'end')):
+            tag = _local_name(element.tag)
+            if event == 'start':
+                path.append(tag)
+                if tag == 'trkseg':
+                    segment = element
+                    segment_start = True
+                continue
+
+            path.pop()
+            if tag == 'trkpt':
+                samples.append(self.__read_trackpoint(element))
+                # the processed trackpoints are dropped from the tree
+                segment.remove(element)
+                if len(samples) == self.chunk_size:
+                    yield pd.DataFrame(samples, columns=COLUMNS), segment_start
+                    samples = []
+                    segment_start = False
+            elif tag == 'trkseg':
+                if samples:
+                    yield pd.DataFrame(samples, columns=COLUMNS), segment_start
+                    samples = []
+            elif tag == 'name' and path and path[-1] == 'trk':
+                self.name = element.text
+            elif tag == 'desc' and path and path[-1] == 'trk':
+                self.description = element.text
+
+    # Returns the data sample of a trackpoint element as a list of values in the COLUMNS order.
+    def __read_trackpoint(self, element):
+        elevation = time = hr = cadence = None
+        for child in element.iter():
+            tag = _local_name(child.tag)
+            if tag == 'ele':
+                elevation = float(child.text)
+            elif tag == 'time':
+                time = datetime.fromisoformat(child.text.strip())
+            elif tag == 'hr':
+                hr = int(child.text)
+            elif tag == 'cad':
+                cadence = int(child.text) * 2
+        return [float(element.get('lat')), float(element.get('lon')), time, elevation, hr, cadence]
+
+# Applies the rules of an ActivityCleaner to the chunks of data samples, so that the metrics are the same computed
+# by Activity. Whether a sample has a wrong time depends on the TIME_WINDOW samples before and after it. Whether a
+# sample is a GPS spike depends on the two valid samples before and after it, and the distance from the previous valid
+# sample on whether one of the two is a spike. For this reason each chunk is cleaned together with the last CONTEXT
+# valid samples already cleaned, as they were read, while the last TIME_WINDOW samples and the samples from the last
+# HOLD valid ones on are held back and cleaned with the next chunk. Heart rate dropouts are fixed by
+# HeartRateAggregator.
+class ChunkCleaner:
+    # The number of valid samples carried before and held back after the cleaned samples
+    CONTEXT = 3
+    HOLD = 2
+
+    def __init__(self, cleaner):
+        self.cleaner = ActivityCleaner(cleaner.max_speed, cleaner.fix_timestamps, cleaner.fix_gps,
+                                       fix_heart_rate=False, max_gap=cleaner.max_gap)
+        self.report = {key: 0 for key in REPORT_KEYS}
+        # The raw valid samples before the pending ones, already cleaned
+        self.context = None
+        # The raw samples not cleaned yet
+        self.pending = None
+        self.segment = -1
+        # The time of the first sample, the last TIME_WINDOW times in seconds from it and the latest valid one
+        self.origin = None
+        self.previous_seconds = np.empty(0)
+        self.latest = -np.inf
+
+    # Returns the samples of the chunk (and of the previous ones) that can be cleaned before reading the next chunk,
+    # with the columns added by ActivityCleaner.
+    def update(self, chunk, segment_start):
+        if segment_start:
+            self.segment += 1
+        return self.__clean(chunk.assign(segment=self.segment), final=False)
+
+    # Returns the samples held back, cleaned, after the last chunk.
+    def finish(self):
+        return self.__clean(None, final=True)
+
+    def __clean(self, chunk, final):
+        samples = pd.concat([frame for frame in (self.context, self.pending, chunk) if frame is not None],
+                            ignore_index=True)
+        start = len(self.context) if self.context is not None else 0
+        if samples.empty:
+            return samples
+        if self.origin is None:
+            self.origin = samples['time'].iloc[0]
+
+        # the context samples are valid, the times of the samples after them are checked once the TIME_WINDOW
+        # samples after them have been read
+        seconds = (samples['time'].iloc[start:] - self.origin).dt.total_seconds().to_numpy()
+        duplicate, out_of_order = self.cleaner.check_timestamps(
+            np.concatenate((self.previous_seconds, seconds)), len(self.previous_seconds), self.latest)
+        duplicate = np.concatenate((np.zeros(start, dtype=bool), duplicate))
+        out_of_order = np.concatenate((np.zeros(start, dtype=bool), out_of_order))
+        valid_rows = np.flatnonzero(~(duplicate | out_of_order))
+        if final:
+            end = len(samples)
+        else:
+            valid_rows = valid_rows[valid_rows < len(samples) - TIME_WINDOW]
+            end = max(start, valid_rows[-self.HOLD] if len(valid_rows) >= self.HOLD else 0)
+
+        counted = np.zeros(len(samples), dtype=bool)
+        counted[start:end] = True
+        cleaned = samples.copy()
+        for key, count in self.cleaner.clean(cleaned, counted, (duplicate, out_of_order)).items():
+            self.report[key] += count
+
+        valid_rows = valid_rows[valid_rows < end]
+        self.context = samples.iloc[valid_rows[-self.CONTEXT:]]
+        self.pending = samples.iloc[end:]
+        self.previous_seconds = np.concatenate((self.previous_seconds, seconds[:end - start]))[-TIME_WINDOW:]
+        if len(valid_rows):
+            self.latest = (samples['time'].iloc[valid_rows[-1]] - self.origin).total_seconds()
+        return cleaned.iloc[start:end]
+
+# Streaming aggregator computing the sum of a column, like distance and elapsed time of the cleaned samples.
+class SumAggregator:
+    def __init__(self, column):
+        self.column = column
+        self.total = 0.0
+
+    def update(self, samples):
+        self.total += samples[self.column].sum()
+
+    def result(self):
+        return float(self.total)
+
+# Streaming aggregator computing the mean and the maximum of a column, ignoring missing values.
+class MeanMaxAggregator:
+    def __init__(self, column):
+        self.column = column
+        self.total = 0
+        self.count = 0
+        self.max = None
+
+    def update(self, samples):
+        self.add(samples[self.column].dropna().to_numpy())
+
+    # Adds the input values, without missing ones, to the mean and the maximum.
+    def add(self, values):
+        if len(values) == 0:
+            return
+        self.total += values.sum()
+        self.count += len(values)
+        values_max = values.max()
+        self.max = values_max if self.max is None else max(self.max, values_max)
+
+    # Returns the mean rounded to the closest integer and the maximum, or (None, None) if there are no values.
+    def result(self):
+        if self.count == 0:
+            return None, None
+        return int(round(self.total / self.count)), int(self.max)
+
+# Streaming aggregator computing mean and maximum heart rate like MeanMaxAggregator, fixing the 0 bpm dropouts like
+# ActivityCleaner: they get the heart rate interpolated in time between the closest non zero samples. The last non
+# zero sample is kept, together with the time of the dropouts after it, until the next non zero sample is read.
+class HeartRateAggregator(MeanMaxAggregator):
+    def __init__(self):
+        super().__init__('hr')
+        self.dropouts = 0
+        self.origin = None
+        # The seconds and the heart rate of the last non zero sample
+        self.last = None
+        # The seconds of the dropouts after the last non zero sample
+        self.pending = np.empty(0)
+
+    def update(self, samples):
+        if samples.empty:
+            return
+        if self.origin is None:
+            self.origin = samples['time'].iloc[0]
+        seconds = (samples['time'] - self.origin).dt.total_seconds().to_numpy()
+        hr = samples['hr'].to_numpy(dtype=float)
+        dropouts = hr == 0
+        good = hr > 0
+        self.dropouts += int(dropouts.sum())
+        self.pending = np.concatenate((self.pending, seconds[dropouts]))
+        if good.any():
+            good_seconds = seconds[good]
+            good_hr = hr[good]
+            if self.last is not None:
+                good_seconds = np.concatenate(([self.last[0]], good_seconds))
+                good_hr = np.concatenate(([self.last[1]], good_hr))
+            fixed = self.pending < good_seconds[-1]
+            self.add(np.round(np.interp(self.pending[fixed], good_seconds, good_hr)))
+            self.pending = self.pending[~fixed]
+            self.last = (good_seconds[-1], good_hr[-1])
+        self.add(hr[good])
+
+    def result(self):
+        # the dropouts after the last non zero sample get its heart rate
+        if self.last is not None:
+            self.add(np.full(len(self.pending), self.last[1]))
+        self.pending = np.empty(0)
+        return super().result()
+
+# Streaming aggregator computing elevation gain and loss like CumulativeElevationCalculator, summing the positive
+# and negative differences between consecutive elevations. The last elevation of each chunk is kept to compute the
+# difference with the first elevation of the next one.
+class ElevationAggregator:
+    def __init__(self):
+        self.elevation_gain = 0.0
+        self.elevation_loss = 0.0
+        self.previous = None
+
+    def update(self, samples):
+        elevations = samples['elevation'].dropna().to_numpy(dtype=float)
+        if len(elevations) == 0:
+            return
+        if self.previous is not None:
+            elevations = np.concatenate(([self.previous], elevations))
+        self.previous = elevations[-1]
+        differences = np.diff(elevations)
+        self.elevation_gain += differences[differences > 0].sum()
+        self.elevation_loss -= differences[differences < 0].sum()
+
+    def result(self):
+        if self.previous is None:
+            return None, None
+        return self.elevation_gain, self.elevation_loss
+
+# Represents a single running workout like Activity, but the summary metrics are computed by streaming aggregators
+# over fixed-size chunks of data samples, so peak memory is bounded regardless of the length of the activity. Neither
+# the GPX tree nor the data stream are kept in memory, for that reason the raw data of the activity is not available.
+#
+# The data samples are cleaned with the same rules of Activity (see ChunkCleaner), the metrics are the same computed
+# by Activity with the default CumulativeElevationCalculator and the same ActivityCleaner:
+# - Workout Duration
+# - Total Distance Covered
+# - Average Pace
+# - Elevation Gain and Loss
+# - Average and Maximum Heart Rate and Cadence
+class ChunkedActivity:
+    def __init__(self, file_path, chunk_size=DEFAULT_CHUNK_SIZE, cleaner=None):
+        self.file_path = file_path
+        self.cleaner = cleaner or ActivityCleaner()
+        self.cleaning_report = None
+        self.time = None
+        self.name = None
+        self.description = None
+        self.duration = None
+        self.distance = None
+        self.average_pace = None
+        self.average_heart_rate = None
+        self.max_heart_rate = None
+        self.elevation_gain = None
+        self.elevation_loss = None
+        self.average_cadence = None
+        self.max_cadence = None
+
+        try:
+            reader = GPXChunkReader(file_path, chunk_size)
+            chunk_cleaner = ChunkCleaner(self.cleaner)
+            distance = SumAggregator('distance')
+            duration = SumAggregator('elapsed')
+            if self.cleaner.fix_heart_rate:
+                heart_rate = HeartRateAggregator()
+            else:
+                heart_rate = MeanMaxAggregator('hr')
+            cadence = MeanMaxAggregator('cadence')
+            elevation = ElevationAggregator()
+            aggregators = [distance, duration, heart_rate, cadence, elevation]
+
+            for chunk, segment_start in reader.read():
+                if self.time is None:
+                    self.time = pd.Timestamp(chunk['time'].iloc[0])
+                self.__aggregate(chunk_cleaner.update(chunk, segment_start), aggregators)
+            self.__aggregate(chunk_cleaner.finish(), aggregators)
+
+            self.cleaning_report = chunk_cleaner.report
+            if self.cleaner.fix_heart_rate:
+                self.cleaning_report['hr_dropouts'] = heart_rate.dropouts
+            self.name = reader.name
+            self.description = reader.description
+            self.duration = duration.result()
+            self.distance = distance.result() / 1000
+            self.average_pace = self.duration / self.distance
+            self.average_heart_rate, self.max_heart_rate = heart_rate.result()
+            self.average_cadence, self.max_cadence = cadence.result()
+            self.elevation_gain, self.elevation_loss = elevation.result()
+
+        except Exception as e:
+            # Raise an exception if there's an error while reading the GPX file
+            raise Exception(f"Error while reading GPX file '{file_path}': {str(e)}")
+
+    # Averages, maximums and elevation don't include the invalid samples (see ActivityCleaner).
+    def __aggregate(self, samples, aggregators):
+        samples = samples[samples['valid']]
+        for aggregator in aggregators:
+            aggregator.update(samples)
+
+    # Get the report of the fixes made by the activity cleaner: fixed samples for each kind of error.
+    def get_cleaning_report(self):
+        return self.cleaning_report
+
+    # Get the date and time of the activity.
+    def get_time(self):
+        return self.time
+
+    # Get the name of the activity.
+    def get_name(self):
+        return self.name
+
+    # Get the description of the activity.
+    def get_description(self):
+        return self.description
+
+    # Get the duration of the activity in seconds.
+    def get_duration(self):
+        return self.duration
+
+    # Get the distance covered during the activity in kilometers.
+    def get_distance(self):
+        return self.distance
+
+    # Get the average pace of the activity in seconds per kilometer.
+    def get_average_pace(self):
+        return self.average_pace
+
+    # Get the average heart rate during the activity.
+    def get_average_heart_rate(self):
+        return self.average_heart_rate
+
+    # Get the maximum heart rate during the activity.
+    def get_max_heart_rate(self):
+        return self.max_heart_rate
+
+    # Get the average cadence (steps per minute) during the activity.
+    def get_average_cadence(self):
+        return self.average_cadence
+
+    # Get the maximum cadence (steps per minute) during the activity.
+    def get_max_cadence(self):
+        return self.max_cadence
+
+    # Get the elevation gain during the activity.
+    def get_elevation_gain(self):
+        return self.elevation_gain
+
+    # Get the elevation loss during the activity.
+    def get_elevation_loss(self):
+        return self.elevation_loss
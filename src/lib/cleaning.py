@@ -0,0 +1,178 @@
+# Cleaning - Fix Recording Errors in the Activity Data Samples
+#
+# This module defines the ActivityCleaner class, which fixes the most common recording errors of GPS watches
+# in the data samples of an activity: duplicate timestamps, out-of-order points, GPS spikes and heart rate dropouts.
+#
+# Copyright (C) 2023 Salvatore D'Angelo
+# Maintainer: Salvatore D'Angelo sasadangelo@gmail.com
+#
+# This file is part of the Running Data Analysis project.
+#
+# SPDX-License-Identifier: MIT
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from src.lib.geo import point_distances
+
+# The counters of the cleaning report, one for each kind of fixed error.
+REPORT_KEYS = ['duplicate_timestamps', 'out_of_order', 'time_gaps', 'gps_spikes', 'gps_jumps', 'hr_dropouts']
+
+# The number of samples before and after a sample its time is compared with to detect a wrong timestamp
+TIME_WINDOW = 5
+
+# This class cleans the data samples of an activity (the activity_data DataFrame of Activity) right after parsing.
+# All the fixes are vectorized and the DataFrame is updated in place, no copy of the data stream is made:
+#
+# - Out-of-order points: a sample whose time is out of order with more than TIME_WINDOW / 2 of the TIME_WINDOW
+#   samples before and after it (e.g. a single timestamp one day ahead) is marked invalid in the 'valid' column. Only
+#   the wrong sample is dropped, not all the samples after it, as long as there are no more than 3 in a row. The
+#   other samples whose time is earlier than the time of the previous valid samples are marked invalid too.
+# - Duplicate timestamps: a sample whose time is the same of the previous valid sample is marked invalid.
+# - Time gaps: two consecutive valid samples more than max_gap seconds apart (e.g. a wrong timestamp at the end of
+#   the track) are treated like two track segments, the time between them is not counted.
+# - GPS spikes: a single sample reached from the previous one and left to the next one faster than max_speed, while
+#   going straight from the previous to the next one is plausible, is moved to the position interpolated in time
+#   between its neighbours.
+# - GPS jumps: a move between two samples faster than max_speed that is not a spike (e.g. the position jumps after
+#   a signal loss) is not counted in the distance.
+# - Heart rate dropouts: 0 bpm samples get the heart rate interpolated in time from the closest valid samples.
+#
+# Each fix can be disabled. The cleaner also adds the columns used by the activity metrics:
+# - 'distance': meters from the previous valid sample of the same track segment (0 for the other samples)
+# - 'elapsed': seconds from the previous valid sample of the same track segment (0 for the other samples)
+# - 'valid': False for duplicate and out-of-order samples
+#
+# With all the fixes disabled distance and elapsed time add up to the same values computed by gpxpy.
+class ActivityCleaner:
+    def __init__(self, max_speed=10.0, fix_timestamps=True, fix_gps=True, fix_heart_rate=True, max_gap=3600):
+        # The maximum plausible speed in meters per second
+        self.max_speed = max_speed
+        # The maximum plausible time in seconds between two samples of the same track segment
+        self.max_gap = max_gap
+        self.fix_timestamps = fix_timestamps
+        self.fix_gps = fix_gps
+        self.fix_heart_rate = fix_heart_rate
+
+    # Cleans the activity data in place and returns the report of the fixes: a dictionary with the number of
+    # fixed samples for each of the REPORT_KEYS. If counted (a boolean array) is given, only the fixes of the
+    # samples where it is True are counted. If timestamps is given, it is the result of check_timestamps for the
+    # samples, which is not computed again.
+    def clean(self, activity_data, counted=None, timestamps=None):
+        report = {key: 0 for key in REPORT_KEYS}
+        if activity_data.empty:
+            return report
+        if counted is None:
+            counted = np.ones(len(activity_data), dtype=bool)
+
+        seconds = self.__get_seconds(activity_data)
+        if 'segment' in activity_data.columns:
+            segments = activity_data['segment'].to_numpy()
+        else:
+            segments = np.zeros(len(activity_data), dtype=int)
+
+        duplicate, out_of_order = timestamps if timestamps is not None else self.check_timestamps(seconds)
+        valid = ~(duplicate | out_of_order)
+        report['duplicate_timestamps'] = int((duplicate & counted).sum())
+        report['out_of_order'] = int((out_of_order & counted).sum())
+
+        # distance and time between consecutive valid samples, nothing is counted between two segments
+        rows = np.flatnonzero(valid)
+        latitudes = activity_data['latitude'].to_numpy(dtype=float)[rows]
+        longitudes = activity_data['longitude'].to_numpy(dtype=float)[rows]
+        if 'elevation' in activity_data.columns:
+            elevations = activity_data['elevation'].to_numpy(dtype=float)[rows]
+        else:
+            elevations = np.full(len(rows), np.nan)
+        same_segment = np.diff(segments[rows]) == 0
+        if self.fix_timestamps:
+            gaps = same_segment & (np.diff(seconds[rows]) > self.max_gap)
+            same_segment &= ~gaps
+            report['time_gaps'] = int((gaps & counted[rows][1:]).sum())
+        distances = point_distances(latitudes, longitudes, elevations) * same_segment
+        elapsed = np.diff(seconds[rows]) * same_segment
+
+        if self.fix_gps and len(rows) > 1:
+            distances = self.__fix_gps(activity_data, rows, latitudes, longitudes, elevations, seconds[rows],
+                                       distances, elapsed, same_segment, counted[rows], report)
+
+        if self.fix_heart_rate and 'hr' in activity_data.columns:
+            self.__fix_heart_rate(activity_data, valid, seconds, counted, report)
+
+        activity_data['distance'] = self.__to_column(len(activity_data), rows, distances)
+        activity_data['elapsed'] = self.__to_column(len(activity_data), rows, elapsed)
+        activity_data['valid'] = valid
+        return report
+
+    # Returns the duplicate and the out-of-order samples (two boolean arrays) among the input times in seconds,
+    # without the first start ones: they are the samples before, only compared with the following ones. The other
+    # samples are compared with the latest valid time before them, or with the input latest one.
+    def check_timestamps(self, seconds, start=0, latest=-np.inf):
+        if not self.fix_timestamps:
+            return np.zeros(len(seconds) - start, dtype=bool), np.zeros(len(seconds) - start, dtype=bool)
+
+        # a sample out of order with more than half of the samples around it has the wrong time
+        padding = np.full(TIME_WINDOW, np.nan)
+        windows = sliding_window_view(np.concatenate((padding, seconds, padding)), 2 * TIME_WINDOW + 1)[start:]
+        seconds = seconds[start:]
+        disorder = ((windows[:, :TIME_WINDOW] > seconds[:, None]).sum(axis=1) +
+                    (windows[:, TIME_WINDOW + 1:] < seconds[:, None]).sum(axis=1))
+        wrong = 2 * disorder > TIME_WINDOW
+
+        # the others are compared with the latest time of the samples before them, without the wrong ones
+        times = np.where(wrong, -np.inf, seconds)
+        previous = np.maximum.accumulate(np.concatenate(([latest], times[:-1])))
+        duplicate = ~wrong & (seconds == previous)
+        out_of_order = wrong | (seconds < previous)
+        return duplicate, out_of_order
+
+    # Returns the seconds of each sample from the first one.
+    def __get_seconds(self, activity_data):
+        return (activity_data['time'] - activity_data['time'].iloc[0]).dt.total_seconds().to_numpy()
+
+    # Moves the GPS spikes between their neighbours and drops the GPS jumps from the distances.
+    # Returns the fixed distances between consecutive valid samples.
+    def __fix_gps(self, activity_data, rows, latitudes, longitudes, elevations, seconds, distances, elapsed,
+                  same_segment, counted, report):
+        fast = same_segment & (distances > self.max_speed * elapsed)
+
+        # a spike is an isolated sample entered and left too fast, whose neighbours are close enough to each other
+        spikes = np.flatnonzero(fast[:-1] & fast[1:]) + 1
+        spikes = spikes[~np.isin(spikes - 1, spikes) & ~np.isin(spikes + 1, spikes)]
+        if len(spikes):
+            neighbours = np.stack((spikes - 1, spikes + 1), axis=1).ravel()
+            skip_distances = point_distances(latitudes[neighbours], longitudes[neighbours], elevations[neighbours])[::2]
+            skip_seconds = seconds[spikes + 1] - seconds[spikes - 1]
+            spikes = spikes[skip_distances <= self.max_speed * skip_seconds]
+        if len(spikes):
+            fraction = (seconds[spikes] - seconds[spikes - 1]) / (seconds[spikes + 1] - seconds[spikes - 1])
+            for coordinates, column in ((latitudes, 'latitude'), (longitudes, 'longitude')):
+                coordinates[spikes] = (coordinates[spikes - 1] +
+                                       (coordinates[spikes + 1] - coordinates[spikes - 1]) * fraction)
+                activity_data.loc[activity_data.index[rows[spikes]], column] = coordinates[spikes]
+            distances = point_distances(latitudes, longitudes, elevations) * same_segment
+            fast = same_segment & (distances > self.max_speed * elapsed)
+        report['gps_spikes'] = int(counted[spikes].sum())
+
+        # the other moves too fast are jumps, they are not counted in the distance
+        report['gps_jumps'] = int((fast & counted[1:]).sum())
+        return np.where(fast, 0.0, distances)
+
+    # Replaces the 0 bpm samples with the heart rate interpolated in time from the valid non zero samples.
+    # Samples without heart rate (NaN) are left missing, the column stays integer only if there are none.
+    def __fix_heart_rate(self, activity_data, valid, seconds, counted, report):
+        hr = activity_data['hr'].to_numpy(dtype=float, copy=True)
+        dropouts = valid & (hr == 0)
+        report['hr_dropouts'] = int((dropouts & counted).sum())
+        if not dropouts.any():
+            return
+        good = valid & (hr > 0)
+        if good.any():
+            hr[dropouts] = np.round(np.interp(seconds[dropouts], seconds[good], hr[good]))
+        else:
+            hr[dropouts] = np.nan
+        activity_data['hr'] = hr if np.isnan(hr).any() else hr.astype(int)
+
+    # Returns a column with the input values on the rows after the first valid one and 0 on the others.
+    def __to_column(self, length, rows, values):
+        column = np.zeros(length)
+        column[rows[1:]] = values
+        return column
@@ -0,0 +1,153 @@
+# Dedup - Detect Duplicate Activities at Ingest
+#
+# This module defines the ActivityDeduplicator class, which is responsible for detecting activities that are
+# imported more than once, e.g. the same workout exported from Garmin Connect and synchronized from Strava.
+# Exact duplicates are detected by the hash of the GPX file content, near duplicates by a compact fingerprint
+# of the activity.
+#
+# Copyright (C) 2023 Salvatore D'Angelo
+# Maintainer: Salvatore D'Angelo sasadangelo@gmail.com
+#
+# This file is part of the Running Data Analysis project.
+#
+# SPDX-License-Identifier: MIT
+import math
+import hashlib
+
+# Number of points of the downsampled track signature
+SIGNATURE_POINTS = 8
+
+# Length in meters of one degree of latitude
+ONE_DEGREE = 111320
+
+# Returns the SHA-256 hash of the file content.
+def content_hash(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 16), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+# The compact fingerprint of an activity used to detect near duplicates:
+# - start time (seconds since epoch)
+# - start location (latitude and longitude)
+# - duration (seconds)
+# - track signature: the positions at SIGNATURE_POINTS evenly spaced instants between start and end.
+#   Sampling by time rather than by sample index makes the signature independent of the recording rate,
+#   so the same workout recorded with smart and 1 second recording has similar signatures.
+class ActivityFingerprint:
+    def __init__(self, start_time, latitude, longitude, duration, signature):
+        self.start_time = start_time
+        self.latitude = latitude
+        self.longitude = longitude
+        self.duration = duration
+        self.signature = signature
+
+    # Creates the fingerprint of the input Activity.
+    @classmethod
+    def from_activity(cls, activity):
+        # imported here so that deduplicating cached fingerprints doesn't load numpy at startup
+        import numpy as np
+        activity_data = activity.get_activity_data()
+        seconds = activity_data['time'].map(lambda time: time.timestamp()).to_numpy(dtype=float)
+        latitudes = activity_data['latitude'].to_numpy(dtype=float)
+        longitudes = activity_data['longitude'].to_numpy(dtype=float)
+        instants = np.linspace(seconds[0], seconds[-1], SIGNATURE_POINTS)
+        signature = list(zip(np.interp(instants, seconds, latitudes), np.interp(instants, seconds, longitudes)))
+        signature = [(float(latitude), float(longitude)) for latitude, longitude in signature]
+        return cls(float(seconds[0]), float(latitudes[0]), float(longitudes[0]), float(seconds[-1] - seconds[0]), signature)
+
+    # Creates the fingerprint from its JSON representation.
+    @classmethod
+    def from_json(cls, data):
+        return cls(data['start_time'], data['latitude'], data['longitude'], data['duration'],
+                   [tuple(point) for point in data['signature']])
+
+    # Returns the JSON representation of the fingerprint.
+    def to_json(self):
+        return {
+            'start_time': self.start_time,
+            'latitude': self.latitude,
+            'longitude': self.longitude,
+            'duration': self.duration,
+            'signature': self.signature
+        }
+
+# This class detects duplicate activities at ingest. Each accepted activity is added to two indexes:
+# - a dictionary from content hash to activity id, for exact duplicates
+# - a dictionary from a coarse (start time, start latitude, start longitude) grid cell to the fingerprints in it,
+#   for near duplicates. Cells are as large as the tolerances, so a near duplicate can only be in the same cell
+#   or in one of the adjacent ones: each new activity is compared with the few fingerprints of 27 cells instead
+#   of with all the activities.
+#
+# Two activities are near duplicates if their start times, start locations and durations are within the
+# tolerances and the mean distance between their track signatures is within the signature tolerance.
+class ActivityDeduplicator:
+    def __init__(self, time_tolerance=120, distance_tolerance=200, duration_tolerance=0.05, signature_tolerance=100):
+        # Maximum start time difference in seconds
+        self.time_tolerance = time_tolerance
+        # Maximum start location distance in meters
+        self.distance_tolerance = distance_tolerance
+        # Maximum duration difference as a fraction of the longest duration
+        self.duration_tolerance = duration_tolerance
+        # Maximum mean distance in meters between the track signatures
+        self.signature_tolerance = signature_tolerance
+        self.hashes = {}
+        self.cells = {}
+        self.activities = {}
+
+    # Returns the id of the activity with the same content hash, or None if there is none.
+    def find_exact(self, file_hash):
+        return self.hashes.get(file_hash)
+
+    # Returns the id of an activity that is a near duplicate of the input fingerprint, or None if there is none.
+    def find_near(self, fingerprint):
+        time_cell, latitude_cell, longitude_cell = self.__get_cell(fingerprint)
+        for dt in (-1, 0, 1):
+            for dlat in (-1, 0, 1):
+                for dlon in (-1, 0, 1):
+                    for activity_id in self.cells.get((time_cell + dt, latitude_cell + dlat, longitude_cell + dlon), []):
+                        if self.__is_near_duplicate(fingerprint, self.activities[activity_id][1]):
+                            return activity_id
+        return None
+
+    # Adds an accepted activity to the indexes.
+    def add(self, activity_id, file_hash, fingerprint):
+        self.activities[activity_id] = (file_hash, fingerprint)
+        self.hashes[file_hash] = activity_id
+        self.cells.setdefault(self.__get_cell(fingerprint), []).append(activity_id)
+
+    # Removes an activity from the indexes. Nothing happens if it is not present.
+    def remove(self, activity_id):
+        if activity_id not in self.activities:
+            return
+        file_hash, fingerprint = self.activities.pop(activity_id)
+        del self.hashes[file_hash]
+        cell = self.__get_cell(fingerprint)
+        self.cells[cell].remove(activity_id)
+        if not self.cells[cell]:
+            del self.cells[cell]
+
+    # Returns the grid cell of the fingerprint start time and location. A degree of longitude gets shorter moving
+    # away from the equator, longitude cells are twice as wide as latitude ones so that they are at least as large
+    # as the distance tolerance up to 60 degrees of latitude.
+    def __get_cell(self, fingerprint):
+        cell_degrees = self.distance_tolerance / ONE_DEGREE
+        return (math.floor(fingerprint.start_time / self.time_tolerance),
+                math.floor(fingerprint.latitude / cell_degrees),
+                math.floor(fingerprint.longitude / (2 * cell_degrees)))
+
+    def __is_near_duplicate(self, fingerprint, other):
+        # imported here so that deduplicating cached fingerprints doesn't load gpxpy at startup
+        from gpxpy.geo import haversine_distance
+        if abs(fingerprint.start_time - other.start_time) > self.time_tolerance:
+            return False
+        if haversine_distance(fingerprint.latitude, fingerprint.longitude,
+                              other.latitude, other.longitude) > self.distance_tolerance:
+            return False
+        if abs(fingerprint.duration - other.duration) > self.duration_tolerance * max(fingerprint.duration, other.duration):
+            return False
+        signature_distance = sum(haversine_distance(latitude, longitude, other_latitude, other_longitude)
+                                 for (latitude, longitude), (other_latitude, other_longitude)
+                                 in zip(fingerprint.signature, other.signature)) / len(fingerprint.signature)
+        return signature_distance <= self.signature_tolerance
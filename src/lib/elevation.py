@@ -2,7 +2,7 @@
 #
 # This module defines various strategies for calculating elevation gain and loss in running workouts.
 # It provides implementations of different elevation calculation algorithms, including cumulative elevation
-# and threshold-based elevation gain/loss calculations.
+# and threshold-based elevation gain/loss calculations, signal smoothing and elevation correction from DEM tiles.
 #
 # Copyright (c) 2023 Salvatore D'Angelo
 # Maintainer: Your Name sasadangelo@gmail.com
@@ -10,6 +10,9 @@
 # This file is part of the Running Data Analysis project.
 #
 # SPDX-License-Identifier: MIT
+import os
+import math
+import numpy as np
 
 # ElevationCalculator Interface - Defines methods for calculating elevation gain and loss.
 # Multiple strategies for elevation gain/loss calculation are available, and this interface serves
@@ -30,7 +33,7 @@ class ElevationCalculator:
 class CumulativeElevationCalculator(ElevationCalculator):
     def calculate(self, elevation_data):
         if 'elevation' in elevation_data.columns:
-            elevation_values = elevation_data['elevation'].tolist()
+            elevation_values = elevation_data['elevation'].dropna().tolist()
             if elevation_values:
                 elevation_gain = 0
                 elevation_loss = 0
@@ -62,9 +65,162 @@ class ThresholdElevationCalculator(ElevationCalculator):
 
     def calculate(self, elevation_data):
         if 'elevation' in elevation_data.columns:
-            elevation_values = elevation_data['elevation'].tolist()
+            elevation_values = elevation_data['elevation'].dropna().tolist()
             if elevation_values:
                 elevation_gain = max(0, sum(max(0, elevation_values[i] - elevation_values[i - 1]) if elevation_values[i] - elevation_values[i - 1] > self.threshold else 0 for i in range(1, len(elevation_values))))
                 elevation_loss = max(0, sum(max(0, elevation_values[i - 1] - elevation_values[i]) if elevation_values[i - 1] - elevation_values[i] > self.threshold else 0 for i in range(1, len(elevation_values))))
                 return elevation_gain, elevation_loss
         return None, None
+
+# Sums the positive and the negative differences between consecutive elevation values (numpy array).
+# This is the vectorized equivalent of CumulativeElevationCalculator, used by the strategies below
+# once the elevation values have been smoothed or corrected.
+def _cumulative_gain_loss(elevation_values):
+    if len(elevation_values) == 0:
+        return None, None
+    differences = np.diff(elevation_values)
+    return float(differences[differences > 0].sum()), float(-differences[differences < 0].sum())
+
+# SmoothedElevationCalculator Class - Implements elevation gain and loss calculation on elevation data
+# smoothed with a Savitzky-Golay filter.
+#
+# The Savitzky-Golay filter fits a polynomial of the given order to each window of samples with least squares
+# and replaces the central sample with the fitted value. Unlike a moving average, it removes the sample to sample
+# noise of barometric and GPS elevation while preserving the shape of real climbs. The filter is a convolution with
+# precomputed coefficients, so the whole activity is smoothed in a single vectorized pass. Gain and loss are then
+# calculated cumulatively on the smoothed values.
+#
+# Usage: Create an instance of this class with the window size (number of samples, odd) and the polynomial order.
+class SmoothedElevationCalculator(ElevationCalculator):
+    def __init__(self, window=15, polyorder=2):
+        if window % 2 == 0:
+            raise ValueError("The Savitzky-Golay window must be odd")
+        if polyorder >= window:
+            raise ValueError("The Savitzky-Golay polynomial order must be less than the window")
+        self.window = window
+        self.polyorder = polyorder
+
+    def calculate(self, elevation_data):
+        if 'elevation' in elevation_data.columns:
+            elevation_values = elevation_data['elevation'].dropna().to_numpy(dtype=float)
+            return _cumulative_gain_loss(self.smooth(elevation_values))
+        return None, None
+
+    # Returns the input elevation values (numpy array) smoothed with the Savitzky-Golay filter. Activities shorter than
+    # the window are smoothed with the largest odd window that fits, or returned unchanged if it is too short for the
+    # polynomial order. The signal is extended at both ends by repeating the first and last value.
+    def smooth(self, elevation_values):
+        window = min(self.window, len(elevation_values) - (1 - len(elevation_values) % 2))
+        if window <= self.polyorder:
+            return elevation_values
+        half_window = window // 2
+        padded_values = np.pad(elevation_values, half_window, mode='edge')
+        return np.convolve(padded_values, self.__coefficients(window)[::-1], mode='valid')
+
+    # Returns the convolution coefficients of the filter: the first row of the pseudo-inverse of the Vandermonde
+    # matrix of the window positions, i.e. the weights giving the value at the center of the fitted polynomial.
+    def __coefficients(self, window):
+        half_window = window // 2
+        positions = np.arange(-half_window, half_window + 1)
+        vandermonde = np.vander(positions, self.polyorder + 1, increasing=True)
+        return np.linalg.pinv(vandermonde)[0]
+
+# DEMTileCache Class - Loads SRTM .hgt Digital Elevation Model tiles from a folder on disk.
+#
+# Each SRTM tile covers one degree of latitude and longitude and is named after its south west corner
+# (e.g. N41E012.hgt covers latitude 41-42 and longitude 12-13). The file is a square grid of big endian 16 bit
+# integers in meters, 1201x1201 samples for SRTM3 (3 arc seconds) or 3601x3601 samples for SRTM1 (1 arc second),
+# stored from north to south and from west to east. Void samples have value -32768.
+#
+# Tiles are memory-mapped, so only the pages containing the samples that are read are loaded from disk, and each tile
+# is opened once and kept in the cache. Share the same cache across activities to avoid opening the tiles again.
+class DEMTileCache:
+    VOID = -32768
+
+    def __init__(self, tiles_folder):
+        self.tiles_folder = tiles_folder
+        # Memory-mapped tiles keyed by tile name. Missing tiles are cached as None.
+        self.tiles = {}
+
+    # Returns the memory-mapped tile containing the input integer latitude and longitude (south west corner),
+    # or None if the tile is not available on disk.
+    def get_tile(self, latitude, longitude):
+        name = f"{'N' if latitude >= 0 else 'S'}{abs(latitude):02d}{'E' if longitude >= 0 else 'W'}{abs(longitude):03d}"
+        if name not in self.tiles:
+            self.tiles[name] = self.__load_tile(name)
+        return self.tiles[name]
+
+    # Memory-maps the tile file. The grid size is derived from the file size.
+    def __load_tile(self, name):
+        tile_path = os.path.join(self.tiles_folder, name + '.hgt')
+        if not os.path.exists(tile_path):
+            return None
+        size = int(math.isqrt(os.path.getsize(tile_path) // 2))
+        return np.memmap(tile_path, dtype='>i2', mode='r', shape=(size, size))
+
+    # Returns the elevation of the input points (numpy arrays of latitudes and longitudes) bilinearly interpolated
+    # from the four surrounding DEM samples. Points in a missing tile or next to a void sample are NaN.
+    def get_elevation(self, latitudes, longitudes):
+        elevation_values = np.full(len(latitudes), np.nan)
+        tile_latitudes = np.floor(latitudes).astype(int)
+        tile_longitudes = np.floor(longitudes).astype(int)
+
+        # the points are processed tile by tile, an activity usually spans one or two tiles
+        for tile_latitude, tile_longitude in set(zip(tile_latitudes, tile_longitudes)):
+            tile = self.get_tile(int(tile_latitude), int(tile_longitude))
+            if tile is None:
+                continue
+            in_tile = (tile_latitudes == tile_latitude) & (tile_longitudes == tile_longitude)
+            size = tile.shape[0]
+
+            # fractional row (from north) and column (from west) of each point in the grid
+            rows = (tile_latitude + 1 - latitudes[in_tile]) * (size - 1)
+            columns = (longitudes[in_tile] - tile_longitude) * (size - 1)
+            row0 = np.clip(np.floor(rows).astype(int), 0, size - 2)
+            column0 = np.clip(np.floor(columns).astype(int), 0, size - 2)
+            row_weight = rows - row0
+            column_weight = columns - column0
+
+            samples = [tile[row0 + dr, column0 + dc].astype(float) for dr in (0, 1) for dc in (0, 1)]
+            void = np.any([sample == self.VOID for sample in samples], axis=0)
+            interpolated = (samples[0] * (1 - row_weight) * (1 - column_weight) +
+                            samples[1] * (1 - row_weight) * column_weight +
+                            samples[2] * row_weight * (1 - column_weight) +
+                            samples[3] * row_weight * column_weight)
+            elevation_values[in_tile] = np.where(void, np.nan, interpolated)
+
+        return elevation_values
+
+# DEMElevationCalculator Class - Implements elevation gain and loss calculation replacing the recorded elevation
+# with the elevation of a Digital Elevation Model (SRTM .hgt tiles on disk).
+#
+# Recorded elevation is affected by barometric drift and GPS noise, which inflate gain and loss, especially on flat
+# terrain. This calculator ignores it and reads the terrain elevation at each latitude and longitude from local DEM
+# tiles, so it works fully offline. Samples outside the available tiles keep their recorded elevation. The corrected
+# elevation is then passed to another calculator (CumulativeElevationCalculator by default), so DEM correction can be
+# combined with the other strategies, e.g. SmoothedElevationCalculator or ThresholdElevationCalculator.
+#
+# Usage: Create an instance of this class with the folder containing the tiles, or with a shared DEMTileCache
+# so that tiles are loaded once across activities.
+class DEMElevationCalculator(ElevationCalculator):
+    def __init__(self, tiles_folder=None, calculator=None, tile_cache=None):
+        if tile_cache is None and tiles_folder is None:
+            raise ValueError("Either the DEM tiles folder or a tile cache must be provided")
+        self.tile_cache = tile_cache or DEMTileCache(tiles_folder)
+        self.calculator = calculator or CumulativeElevationCalculator()
+
+    def calculate(self, elevation_data):
+        if elevation_data.empty:
+            return None, None
+        return self.calculator.calculate(self.correct(elevation_data))
+
+    # Returns a copy of the input activity data with the 'elevation' column replaced by the DEM elevation.
+    def correct(self, elevation_data):
+        dem_elevation = self.tile_cache.get_elevation(elevation_data['latitude'].to_numpy(dtype=float),
+                                                      elevation_data['longitude'].to_numpy(dtype=float))
+        corrected_data = elevation_data.copy()
+        if 'elevation' in elevation_data.columns:
+            recorded_elevation = elevation_data['elevation'].to_numpy(dtype=float)
+            dem_elevation = np.where(np.isnan(dem_elevation), recorded_elevation, dem_elevation)
+        corrected_data['elevation'] = dem_elevation
+        return corrected_data
@@ -0,0 +1,163 @@
+# Export - Export Athlete's Activities to a Partitioned Columnar Dataset
+#
+# This module defines the ActivityExporter class, which is responsible for exporting the athlete's activities
+# to a columnar dataset (Arrow IPC or Parquet) partitioned by year and month. The dataset can be queried with
+# tools like pandas, pyarrow or DuckDB without parsing the GPX files.
+#
+# Copyright (C) 2023 Salvatore D'Angelo
+# Maintainer: Salvatore D'Angelo sasadangelo@gmail.com
+#
+# This file is part of the Running Data Analysis project.
+#
+# SPDX-License-Identifier: MIT
+import os
+import pyarrow as pa
+import pyarrow.feather as feather
+import pyarrow.parquet as pq
+from src.lib.activity import Activity
+
+# The file extension used for each supported format.
+FORMATS = {
+    'arrow': '.arrow',
+    'parquet': '.parquet'
+}
+
+# The columns of the activity stream. Optional columns not present in the GPX file are exported as nulls,
+# so that all the stream files of the dataset share the same schema.
+STREAM_SCHEMA = pa.schema([
+    ('activity_id', pa.string()),
+    ('time', pa.timestamp('ms', tz='UTC')),
+    ('latitude', pa.float64()),
+    ('longitude', pa.float64()),
+    ('elevation', pa.float64()),
+    ('hr', pa.int32()),
+    ('cadence', pa.int32())
+])
+
+SUMMARY_SCHEMA = pa.schema([
+    ('activity_id', pa.string()),
+    ('time', pa.timestamp('ms', tz='UTC')),
+    ('name', pa.string()),
+    ('description', pa.string()),
+    ('distance', pa.float64()),
+    ('duration', pa.float64()),
+    ('average_pace', pa.float64()),
+    ('average_heart_rate', pa.int32()),
+    ('max_heart_rate', pa.int32()),
+    ('average_cadence', pa.int32()),
+    ('max_cadence', pa.int32()),
+    ('elevation_gain', pa.float64()),
+    ('elevation_loss', pa.float64())
+])
+
+# This class exports the activities stored in a folder of GPX files to a columnar dataset with the layout:
+#
+#   <output_folder>/summaries/year=YYYY/month=MM/<activity_id>.<ext>
+#   <output_folder>/streams/year=YYYY/month=MM/<activity_id>.<ext>
+#
+# where the summaries contain one row per activity and the streams one row per data sample. Year and month
+# are taken from the activity start time (hive partitioning, understood by pyarrow.dataset and DuckDB).
+#
+# The export is incremental: activities whose summary file already exists are not parsed again. Activities
+# are processed one at a time and each one is written to its own files, so memory usage is bounded by the
+# largest activity and not by the size of the athlete history.
+#
+# The default 'arrow' format writes uncompressed Arrow IPC files that can be memory-mapped and read with
+# zero copies (e.g. pyarrow.dataset.dataset(path, format='arrow')). The 'parquet' format is more compact
+# but needs to be decoded when read.
+class ActivityExporter:
+    def __init__(self, output_folder, format='arrow'):
+        if format not in FORMATS:
+            raise ValueError(f"Unsupported export format '{format}', use one of: {', '.join(FORMATS)}")
+        self.output_folder = output_folder
+        self.format = format
+        # The ids of the exported activities, built the first time it is needed by scanning the summaries.
+        self.exported = None
+
+    # Exports all the GPX files in the input folder not exported yet. Returns the number of exported activities.
+    def export_folder(self, activities_folder):
+        exported = 0
+        for filename in sorted(os.listdir(activities_folder)):
+            if filename.endswith('.gpx') and not self.is_exported(self.__get_activity_id(filename)):
+                try:
+                    self.export_activity(os.path.join(activities_folder, filename))
+                    exported += 1
+                except Exception as e:
+                    print(f"Error: {str(e)}")
+        return exported
+
+    # Returns True if the activity with the input id has already been exported.
+    def is_exported(self, activity_id):
+        if self.exported is None:
+            self.exported = set()
+            summaries_folder = os.path.join(self.output_folder, 'summaries')
+            for _, _, filenames in os.walk(summaries_folder):
+                for filename in filenames:
+                    if filename.endswith(FORMATS[self.format]):
+                        self.exported.add(filename[:-len(FORMATS[self.format])])
+        return activity_id in self.exported
+
+    # Parses the input GPX file and writes its stream and summary to the dataset.
+    def export_activity(self, file_path):
+        activity_id = self.__get_activity_id(os.path.basename(file_path))
+        activity = Activity(file_path)
+        time = activity.get_time().tz_convert('UTC')
+        partition = os.path.join(f'year={time.year:04d}', f'month={time.month:02d}')
+
+        # The stream is written before the summary: the summary file marks the activity as exported,
+        # so an interrupted export is completed the next time it runs.
+        self.__write(self.__create_stream_table(activity_id, activity), 'streams', partition, activity_id)
+        self.__write(self.__create_summary_table(activity_id, activity, time), 'summaries', partition, activity_id)
+        if self.exported is not None:
+            self.exported.add(activity_id)
+
+    # Creates the Arrow table with the data samples of the activity.
+    def __create_stream_table(self, activity_id, activity):
+        activity_data = activity.get_activity_data()
+        columns = {'activity_id': pa.array([activity_id] * len(activity_data), pa.string())}
+        for field in STREAM_SCHEMA:
+            if field.name == 'activity_id':
+                continue
+            if field.name not in activity_data.columns:
+                columns[field.name] = pa.nulls(len(activity_data), field.type)
+            elif field.name == 'time':
+                columns[field.name] = pa.array(activity_data['time'].dt.tz_convert('UTC'), field.type)
+            else:
+                columns[field.name] = pa.array(activity_data[field.name], field.type, from_pandas=True)
+        return pa.table(columns, schema=STREAM_SCHEMA)
+
+    # Creates the Arrow table with the single row summary of the activity.
+    def __create_summary_table(self, activity_id, activity, time):
+        row = {
+            'activity_id': activity_id,
+            'time': time.to_pydatetime(),
+            'name': activity.get_name(),
+            'description': activity.get_description(),
+            'distance': activity.get_distance(),
+            'duration': activity.get_duration(),
+            'average_pace': activity.get_average_pace(),
+            'average_heart_rate': activity.get_average_heart_rate(),
+            'max_heart_rate': activity.get_max_heart_rate(),
+            'average_cadence': activity.get_average_cadence(),
+            'max_cadence': activity.get_max_cadence(),
+            'elevation_gain': activity.get_elevation_gain(),
+            'elevation_loss': activity.get_elevation_loss()
+        }
+        return pa.Table.from_pylist([row], schema=SUMMARY_SCHEMA)
+
+    # Writes the table to <output_folder>/<dataset>/<partition>/<activity_id>.<ext>. The file is written with a
+    # temporary name and renamed at the end, so readers never see partially written files.
+    def __write(self, table, dataset, partition, activity_id):
+        folder = os.path.join(self.output_folder, dataset, partition)
+        os.makedirs(folder, exist_ok=True)
+        file_path = os.path.join(folder, activity_id + FORMATS[self.format])
+        temp_path = file_path + '.tmp'
+        if self.format == 'arrow':
+            feather.write_feather(table, temp_path, compression='uncompressed')
+        else:
+            pq.write_table(table, temp_path)
+        os.replace(temp_path, file_path)
+
+    # The activity id is the GPX file name without extension.
+    def __get_activity_id(self, filename):
+        return os.path.splitext(filename)[0]
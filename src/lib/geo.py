@@ -0,0 +1,39 @@
+# Geo - Vectorized Distance Calculations
+#
+# This module defines the distance functions shared by the modules that work on the activity data samples
+# with numpy arrays instead of gpxpy objects.
+#
+# Copyright (C) 2023 Salvatore D'Angelo
+# Maintainer: Salvatore D'Angelo sasadangelo@gmail.com
+#
+# This file is part of the Running Data Analysis project.
+#
+# SPDX-License-Identifier: MIT
+import numpy as np
+from gpxpy.geo import EARTH_RADIUS, ONE_DEGREE
+
+# Returns the 3D distances in meters between consecutive samples (numpy arrays of latitudes, longitudes and
+# elevations, NaN where elevation is missing), with the same algorithm as gpxpy (length_3d): a flat earth
+# approximation for close points, and haversine for points more than 0.2 degrees apart.
+# The result has one element less than the input arrays.
+def point_distances(latitudes, longitudes, elevations):
+    latitude_1, latitude_2 = latitudes[1:], latitudes[:-1]
+    longitude_1, longitude_2 = longitudes[1:], longitudes[:-1]
+
+    # flat earth distance, with elevation if available for both points
+    x = latitude_1 - latitude_2
+    y = (longitude_1 - longitude_2) * np.cos(np.radians(latitude_1))
+    distance_2d = np.sqrt(x * x + y * y) * ONE_DEGREE
+    elevation_difference = np.nan_to_num(elevations[1:] - elevations[:-1])
+    distances = np.sqrt(distance_2d ** 2 + elevation_difference ** 2)
+
+    # haversine distance for distant points
+    distant = (np.abs(x) > .2) | (np.abs(longitude_1 - longitude_2) > .2)
+    if distant.any():
+        d_lon = np.radians(longitude_1 - longitude_2)
+        lat1 = np.radians(latitude_1)
+        lat2 = np.radians(latitude_2)
+        a = np.sin((lat1 - lat2) / 2) ** 2 + np.sin(d_lon / 2) ** 2 * np.cos(lat1) * np.cos(lat2)
+        distances = np.where(distant, EARTH_RADIUS * 2 * np.arcsin(np.sqrt(a)), distances)
+
+    return distances
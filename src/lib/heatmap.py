@@ -0,0 +1,218 @@
+# Heatmap - Pre-rendered Tile Pyramid of the Athlete's Routes
+#
+# This module defines the HeatmapTiles class, which rasterizes the tracks of all the athlete's activities into a
+# pyramid of XYZ (slippy map) tiles. Tiles are cached on disk and updated incrementally when new activities arrive,
+# so showing the heatmap only requires reading precomputed images.
+#
+# Copyright (C) 2023 Salvatore D'Angelo
+# Maintainer: Salvatore D'Angelo sasadangelo@gmail.com
+#
+# This file is part of the Running Data Analysis project.
+#
+# SPDX-License-Identifier: MIT
+import os
+import json
+import math
+import zlib
+import struct
+import numpy as np
+
+TILE_SIZE = 256
+
+# Number of activities passing on a pixel at which its color saturates. Colors don't depend on the other tiles,
+# so adding an activity only requires to render again the tiles it touches.
+SATURATION = 20
+
+# Consecutive samples further apart than this number of pixels at zoom 16 (about 180 meters at our latitude) are
+# not joined by a line, they are usually a GPS signal loss or a paused activity.
+MAX_GAP_PIXELS = 100
+
+# Writes an RGBA image (numpy array of shape (height, width, 4) and type uint8) to a PNG file.
+def write_png(file_path, rgba):
+    height, width, _ = rgba.shape
+    # each scanline is preceded by the filter type, 0 means no filter
+    raw = np.concatenate([np.zeros((height, 1), dtype=np.uint8), rgba.reshape(height, width * 4)], axis=1)
+
+    def chunk(chunk_type, data):
+        return (struct.pack('>I', len(data)) + chunk_type + data +
+                struct.pack('>I', zlib.crc32(chunk_type + data) & 0xffffffff))
+
+    with open(file_path, 'wb') as png_file:
+        png_file.write(b'\x89PNG\r\n\x1a\n')
+        png_file.write(chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 6, 0, 0, 0)))
+        png_file.write(chunk(b'IDAT', zlib.compress(raw.tobytes(), 6)))
+        png_file.write(chunk(b'IEND', b''))
+
+# Reads an RGBA PNG file written by write_png and returns it as a numpy array of shape (height, width, 4).
+# It doesn't support the other PNG formats.
+def read_png(file_path):
+    with open(file_path, 'rb') as png_file:
+        data = png_file.read()
+    position = 8
+    width = height = None
+    idat = b''
+    while position < len(data):
+        length, chunk_type = struct.unpack('>I4s', data[position:position + 8])
+        body = data[position + 8:position + 8 + length]
+        if chunk_type == b'IHDR':
+            width, height = struct.unpack('>II', body[:8])
+        elif chunk_type == b'IDAT':
+            idat += body
+        position += 12 + length
+    raw = np.frombuffer(zlib.decompress(idat), dtype=np.uint8).reshape(height, 1 + width * 4)
+    if raw[:, 0].any():
+        raise ValueError(f"Unsupported PNG filter in '{file_path}'")
+    return raw[:, 1:].reshape(height, width, 4)
+
+# Converts latitudes and longitudes (numpy arrays) to Web Mercator global pixel coordinates at the input zoom.
+def to_pixels(latitudes, longitudes, zoom):
+    scale = TILE_SIZE * 2 ** zoom
+    x = (longitudes + 180) / 360 * scale
+    latitudes = np.radians(np.clip(latitudes, -85.0511, 85.0511))
+    y = (1 - np.log(np.tan(latitudes) + 1 / np.cos(latitudes)) / math.pi) / 2 * scale
+    return x, y
+
+# Returns the pixels crossed by the track, joining consecutive samples with straight lines.
+# Each segment is split in steps no longer than one pixel, all the segments at once.
+def rasterize_track(x, y, max_gap):
+    if len(x) < 2:
+        return x, y
+    dx = np.diff(x)
+    dy = np.diff(y)
+    steps = np.maximum(1, np.ceil(np.maximum(np.abs(dx), np.abs(dy)))).astype(int)
+    steps[np.hypot(dx, dy) > max_gap] = 1
+    segment = np.repeat(np.arange(len(steps)), steps)
+    fraction = (np.arange(steps.sum()) - np.repeat(np.cumsum(steps) - steps, steps)) / steps[segment]
+    return (np.append(x[segment] + dx[segment] * fraction, x[-1]),
+            np.append(y[segment] + dy[segment] * fraction, y[-1]))
+
+# Converts pass counts to colors: transparent where no activity passed, from red to yellow and white as the
+# number of passes approaches the saturation.
+def render_counts(counts):
+    intensity = np.clip(np.log1p(counts) / math.log1p(SATURATION), 0, 1)
+    rgba = np.zeros(counts.shape + (4,), dtype=np.uint8)
+    rgba[..., 0] = 255
+    rgba[..., 1] = (60 + 195 * intensity).astype(np.uint8)
+    rgba[..., 2] = (255 * np.clip((intensity - 0.7) / 0.3, 0, 1)).astype(np.uint8)
+    rgba[..., 3] = np.where(counts > 0, 80 + 175 * intensity, 0).astype(np.uint8)
+    return rgba
+
+# This class maintains the heatmap tile pyramid of an athlete in a folder with the layout:
+#
+#   <tiles_folder>/manifest.json           activities already rasterized and bounding box of the tracks
+#   <tiles_folder>/counts/<z>/<x>/<y>.npy  number of activities passing on each pixel of the tile
+#   <tiles_folder>/<z>/<x>/<y>.png         rendered tile, the standard XYZ layout
+#
+# Each activity is rasterized at all the zoom levels with vectorized operations: its track is converted to pixel
+# coordinates, densified into a continuous line, and each pixel is counted once per activity. Only the tiles touched
+# by new activities are loaded, updated, rendered and saved again.
+class HeatmapTiles:
+    def __init__(self, tiles_folder, min_zoom=10, max_zoom=16):
+        self.tiles_folder = tiles_folder
+        self.min_zoom = min_zoom
+        self.max_zoom = max_zoom
+        self.manifest = {'activities': [], 'bounds': None}
+        manifest_path = os.path.join(tiles_folder, 'manifest.json')
+        if os.path.exists(manifest_path):
+            with open(manifest_path, 'r') as manifest_file:
+                self.manifest = json.load(manifest_file)
+
+    # Rasterizes the GPX files not yet in the heatmap. Returns the number of added activities.
+    def update(self, file_paths):
+        # imported on first use, it isn't needed to display the heatmap
+        from src.lib.activity import Activity
+
+        included = set(self.manifest['activities'])
+        dirty_tiles = {}
+        added = 0
+        for file_path in file_paths:
+            activity_id = os.path.basename(file_path)
+            if activity_id in included:
+                continue
+            try:
+                activity_data = Activity(file_path).get_activity_data()
+            except Exception as e:
+                print(f"Error: {str(e)}")
+                continue
+            self.__add_track(activity_data['latitude'].to_numpy(dtype=float),
+                             activity_data['longitude'].to_numpy(dtype=float), dirty_tiles)
+            self.manifest['activities'].append(activity_id)
+            included.add(activity_id)
+            added += 1
+
+        if added:
+            self.__save(dirty_tiles)
+        return added
+
+    # Returns the path of the rendered tile, or None if no activity passes on it.
+    def get_tile_path(self, zoom, x, y):
+        tile_path = os.path.join(self.tiles_folder, str(zoom), str(x), f'{y}.png')
+        return tile_path if os.path.exists(tile_path) else None
+
+    # Returns the range of tiles (min x, min y, max x, max y) covering all the tracks at the input zoom,
+    # or None if the heatmap is empty.
+    def get_tile_range(self, zoom):
+        if self.manifest['bounds'] is None:
+            return None
+        min_latitude, min_longitude, max_latitude, max_longitude = self.manifest['bounds']
+        x, y = to_pixels(np.array([max_latitude, min_latitude]), np.array([min_longitude, max_longitude]), zoom)
+        return int(x[0] // TILE_SIZE), int(y[0] // TILE_SIZE), int(x[1] // TILE_SIZE), int(y[1] // TILE_SIZE)
+
+    # Returns the image (RGBA numpy array) of the rendered tiles in the input range stitched together.
+    def compose(self, zoom, tile_range):
+        min_x, min_y, max_x, max_y = tile_range
+        image = np.zeros(((max_y - min_y + 1) * TILE_SIZE, (max_x - min_x + 1) * TILE_SIZE, 4), dtype=np.uint8)
+        for x in range(min_x, max_x + 1):
+            for y in range(min_y, max_y + 1):
+                tile_path = self.get_tile_path(zoom, x, y)
+                if tile_path is not None:
+                    top, left = (y - min_y) * TILE_SIZE, (x - min_x) * TILE_SIZE
+                    image[top:top + TILE_SIZE, left:left + TILE_SIZE] = read_png(tile_path)
+        return image
+
+    # Adds the track to the pass counts of the tiles it crosses at every zoom level.
+    def __add_track(self, latitudes, longitudes, dirty_tiles):
+        if len(latitudes) == 0:
+            return
+        self.__extend_bounds(latitudes, longitudes)
+        for zoom in range(self.min_zoom, self.max_zoom + 1):
+            x, y = to_pixels(latitudes, longitudes, zoom)
+            x, y = rasterize_track(x, y, MAX_GAP_PIXELS / 2 ** (16 - zoom))
+            # each pixel is counted once per activity, whatever the number of times the track crosses it
+            pixels = np.unique(np.floor(y).astype(np.int64) * (TILE_SIZE << zoom) + np.floor(x).astype(np.int64))
+            pixel_y, pixel_x = np.divmod(pixels, TILE_SIZE << zoom)
+            tile_keys = (pixel_x // TILE_SIZE) * (1 << zoom) + pixel_y // TILE_SIZE
+            for tile_key in np.unique(tile_keys):
+                in_tile = tile_keys == tile_key
+                tile = (zoom, int(tile_key // (1 << zoom)), int(tile_key % (1 << zoom)))
+                if tile not in dirty_tiles:
+                    dirty_tiles[tile] = self.__load_counts(*tile)
+                dirty_tiles[tile][pixel_y[in_tile] % TILE_SIZE, pixel_x[in_tile] % TILE_SIZE] += 1
+
+    def __extend_bounds(self, latitudes, longitudes):
+        bounds = [latitudes.min(), longitudes.min(), latitudes.max(), longitudes.max()]
+        if self.manifest['bounds'] is not None:
+            old = self.manifest['bounds']
+            bounds = [min(old[0], bounds[0]), min(old[1], bounds[1]), max(old[2], bounds[2]), max(old[3], bounds[3])]
+        self.manifest['bounds'] = [float(value) for value in bounds]
+
+    def __get_counts_path(self, zoom, x, y):
+        return os.path.join(self.tiles_folder, 'counts', str(zoom), str(x), f'{y}.npy')
+
+    def __load_counts(self, zoom, x, y):
+        counts_path = self.__get_counts_path(zoom, x, y)
+        if os.path.exists(counts_path):
+            return np.load(counts_path)
+        return np.zeros((TILE_SIZE, TILE_SIZE), dtype=np.uint32)
+
+    # Saves the pass counts and the rendered images of the updated tiles, then the manifest.
+    def __save(self, dirty_tiles):
+        for (zoom, x, y), counts in dirty_tiles.items():
+            counts_path = self.__get_counts_path(zoom, x, y)
+            os.makedirs(os.path.dirname(counts_path), exist_ok=True)
+            np.save(counts_path, counts)
+            tile_folder = os.path.join(self.tiles_folder, str(zoom), str(x))
+            os.makedirs(tile_folder, exist_ok=True)
+            write_png(os.path.join(tile_folder, f'{y}.png'), render_counts(counts))
+        with open(os.path.join(self.tiles_folder, 'manifest.json'), 'w') as manifest_file:
+            json.dump(self.manifest, manifest_file)
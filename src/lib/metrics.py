@@ -0,0 +1,263 @@
+# Metrics - Declarative Registry of the Activity Metrics
+#
+# This module defines the registry of the metrics that can be computed on an activity and the ActivityMetrics class,
+# which computes on demand only the requested metrics and the intermediate results they depend on.
+#
+# Copyright (C) 2023 Salvatore D'Angelo
+# Maintainer: Salvatore D'Angelo sasadangelo@gmail.com
+#
+# This file is part of the Running Data Analysis project.
+#
+# SPDX-License-Identifier: MIT
+import numpy as np
+from src.lib.activity import HEART_RATE_ZONES
+
+# The registered metrics, keyed by name
+METRICS = {}
+
+# Describes a metric: the columns of the activity data it reads, the metrics it depends on, the parameters it
+# accepts and the function that computes it. The function receives the activity, a dictionary with the values of the
+# metrics it depends on and the parameters as keyword arguments.
+class Metric:
+    def __init__(self, name, columns, depends, function, parameters=()):
+        self.name = name
+        self.columns = columns
+        self.depends = depends
+        self.function = function
+        self.parameters = parameters
+
+# Registers the decorated function as the metric with the input name, its input columns, dependencies and parameters.
+def metric(name, columns=(), depends=(), parameters=()):
+    def register(function):
+        METRICS[name] = Metric(name, list(columns), list(depends), function, list(parameters))
+        return function
+    return register
+
+# Returns a hashable version of a parameter value, dictionaries (e.g. the best effort distances) become tuples.
+def _freeze(value):
+    if isinstance(value, dict):
+        return tuple(sorted((key, _freeze(item)) for key, item in value.items()))
+    if isinstance(value, list):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+# Returns the input metrics and all the metrics they depend on, each one after its dependencies.
+def resolve(names):
+    order = []
+    resolved = set()
+    visiting = set()
+
+    def visit(name):
+        if name in resolved:
+            return
+        if name not in METRICS:
+            raise ValueError(f"Unknown metric '{name}'")
+        if name in visiting:
+            raise ValueError(f"Circular dependency on metric '{name}'")
+        visiting.add(name)
+        for dependency in METRICS[name].depends:
+            visit(dependency)
+        visiting.discard(name)
+        resolved.add(name)
+        order.append(name)
+
+    for name in names:
+        visit(name)
+    return order
+
+# This class computes the metrics of an activity on demand. A request for a set of metrics resolves their
+# dependencies, and each metric, including shared intermediate results like the cumulative distance, is computed
+# once and memoized for the following requests.
+#
+# A metric is None if one of its input columns is missing from the activity data (e.g. heart rate metrics on a GPX
+# file without heart rate) or one of the metrics it depends on is None.
+#
+# Parameterized metrics (e.g. the time in the heart rate zones of a maximum heart rate) are memoized for each value
+# of their parameters and of the parameters of the metrics they depend on. A parameter not given is None.
+class ActivityMetrics:
+    def __init__(self, activity):
+        self.activity = activity
+        # The computed metrics: name -> {parameter values: value}
+        self.results = {}
+
+    # Computes the input metrics with the input parameters (a name -> value dictionary), if not already computed,
+    # and returns them as a name -> value dictionary.
+    def compute(self, names, parameters=None):
+        parameters = parameters or {}
+        columns = self.activity.get_activity_data().columns
+        # the parameters each metric depends on, directly or through the metrics it depends on
+        used = {}
+        keys = {}
+        for name in resolve(names):
+            metric = METRICS[name]
+            used[name] = set(metric.parameters).union(*(used[dependency] for dependency in metric.depends))
+            keys[name] = tuple((parameter, _freeze(parameters.get(parameter))) for parameter in sorted(used[name]))
+            results = self.results.setdefault(name, {})
+            if keys[name] in results:
+                continue
+            inputs = {dependency: self.results[dependency][keys[dependency]] for dependency in metric.depends}
+            missing_columns = any(column not in columns for column in metric.columns)
+            if missing_columns or any(value is None for value in inputs.values()):
+                results[keys[name]] = None
+            else:
+                arguments = {parameter: parameters.get(parameter) for parameter in metric.parameters}
+                results[keys[name]] = metric.function(self.activity, inputs, **arguments)
+        return {name: self.results[name][keys[name]] for name in names}
+
+    # Returns the value of the input metric with the input parameters.
+    def get(self, name, parameters=None):
+        return self.compute([name], parameters)[name]
+
+    # Forgets the input metrics and the metrics depending on them, they will be computed again when requested.
+    def invalidate(self, names):
+        invalid = set(names)
+        for name in resolve(self.results):
+            if name in invalid or invalid.intersection(METRICS[name].depends):
+                invalid.add(name)
+                self.results.pop(name, None)
+
+# The metrics of the activities. Distances are computed from the distance and elapsed columns of the cleaned
+# data samples (see cleaning.py), averages and maximums don't include the invalid samples.
+
+# Date and time of the first data sample.
+@metric('time', columns=['time'])
+def _time(activity, inputs):
+    return activity.get_activity_data()['time'].iloc[0]
+
+# Seconds from the start of each sample, invalid samples have the time of the previous valid one.
+@metric('seconds', columns=['time', 'valid'])
+def _seconds(activity, inputs):
+    activity_data = activity.get_activity_data()
+    seconds = (activity_data['time'] - activity_data['time'].iloc[0]).dt.total_seconds()
+    return seconds.where(activity_data['valid']).ffill().to_numpy()
+
+# Meters covered from the start at each sample.
+@metric('cumulative_distance', columns=['distance'])
+def _cumulative_distance(activity, inputs):
+    return activity.get_activity_data()['distance'].to_numpy().cumsum()
+
+# Distance in kilometers.
+@metric('distance', depends=['cumulative_distance'])
+def _distance(activity, inputs):
+    cumulative_distance = inputs['cumulative_distance']
+    return float(cumulative_distance[-1]) / 1000 if len(cumulative_distance) else 0.0
+
+# Duration in seconds. Like gpxpy, the time between two track segments is not counted.
+@metric('duration', columns=['elapsed'])
+def _duration(activity, inputs):
+    return float(activity.get_activity_data()['elapsed'].sum())
+
+# Average pace in seconds per kilometer.
+@metric('average_pace', depends=['duration', 'distance'])
+def _average_pace(activity, inputs):
+    return inputs['duration'] / inputs['distance'] if inputs['distance'] else None
+
+# The data samples the elevation calculator works on, copied only if some samples are invalid.
+@metric('valid_data', columns=['valid'])
+def _valid_data(activity, inputs):
+    activity_data = activity.get_activity_data()
+    valid = activity_data['valid']
+    return activity_data if valid.all() else activity_data[valid]
+
+# Elevation gain and loss computed with the elevation calculator of the activity.
+@metric('elevation', depends=['valid_data'])
+def _elevation(activity, inputs):
+    return activity.get_elevation_calculator().calculate(inputs['valid_data'])
+
+@metric('elevation_gain', depends=['elevation'])
+def _elevation_gain(activity, inputs):
+    return inputs['elevation'][0]
+
+@metric('elevation_loss', depends=['elevation'])
+def _elevation_loss(activity, inputs):
+    return inputs['elevation'][1]
+
+# Heart rate of the valid samples, or None if there is none.
+@metric('valid_heart_rate', columns=['hr', 'valid'])
+def _valid_heart_rate(activity, inputs):
+    activity_data = activity.get_activity_data()
+    heart_rate = activity_data['hr'][activity_data['valid']].dropna()
+    return heart_rate if not heart_rate.empty else None
+
+@metric('average_heart_rate', depends=['valid_heart_rate'])
+def _average_heart_rate(activity, inputs):
+    return int(round(inputs['valid_heart_rate'].mean()))
+
+@metric('max_heart_rate', depends=['valid_heart_rate'])
+def _max_heart_rate(activity, inputs):
+    return inputs['valid_heart_rate'].max()
+
+# Cadence (steps per minute) of the valid samples, or None if there is none.
+@metric('valid_cadence', columns=['cadence', 'valid'])
+def _valid_cadence(activity, inputs):
+    activity_data = activity.get_activity_data()
+    cadence = activity_data['cadence'][activity_data['valid']].dropna()
+    return cadence if not cadence.empty else None
+
+@metric('average_cadence', depends=['valid_cadence'])
+def _average_cadence(activity, inputs):
+    return int(round(inputs['valid_cadence'].mean()))
+
+@metric('max_cadence', depends=['valid_cadence'])
+def _max_cadence(activity, inputs):
+    return inputs['valid_cadence'].max()
+
+# Seconds spent in each heart rate zone, from Z1 to Z5, defined as fractions of the max_heart_rate parameter (see
+# HEART_RATE_ZONES). Each sample is weighted with the time elapsed since the previous valid sample, the time of the
+# samples without heart rate is not part of any zone.
+@metric('time_in_zones', columns=['hr', 'elapsed'], parameters=['max_heart_rate'])
+def _time_in_zones(activity, inputs, max_heart_rate):
+    activity_data = activity.get_activity_data()
+    zones = [0] * (len(HEART_RATE_ZONES) + 1)
+    hr = activity_data['hr']
+    zone = sum((hr >= limit * max_heart_rate).astype(int) for limit in HEART_RATE_ZONES)
+    for index, seconds in activity_data['elapsed'][hr.notna()].groupby(zone[hr.notna()]).sum().items():
+        zones[index] = float(seconds)
+    return zones
+
+# Meters covered from the start at each sample, counted in the best efforts. If the max_speed_ratio parameter is
+# given, the moves between two samples faster than max_speed_ratio times the median speed of the activity (weighted
+# by time) are GPS drift and are not counted.
+@metric('effort_distance', depends=['cumulative_distance', 'seconds'], parameters=['max_speed_ratio'])
+def _effort_distance(activity, inputs, max_speed_ratio):
+    cumulative_distance = inputs['cumulative_distance']
+    seconds = inputs['seconds']
+    if max_speed_ratio is None or len(cumulative_distance) < 2:
+        return cumulative_distance
+
+    steps = np.diff(cumulative_distance, prepend=0.0)
+    step_seconds = np.diff(seconds, prepend=seconds[0])
+    moving = (steps > 0) & (step_seconds > 0)
+    if not moving.any():
+        return cumulative_distance
+    speeds = steps[moving] / step_seconds[moving]
+    order = np.argsort(speeds)
+    weights = np.cumsum(step_seconds[moving][order])
+    median_speed = speeds[order][np.searchsorted(weights, weights[-1] / 2)]
+    drift = np.zeros(len(steps), dtype=bool)
+    drift[moving] = speeds > max_speed_ratio * median_speed
+    return np.where(drift, 0.0, steps).cumsum()
+
+# For each of the distances parameter (name -> meters) the shortest time in seconds needed to cover it, or None if
+# the activity is shorter. For each sample, the first sample at least the given distance ahead is found with a binary
+# search on the effort distance, and the crossing time is linearly interpolated between the two samples around it.
+@metric('best_efforts', depends=['effort_distance', 'seconds'], parameters=['distances'])
+def _best_efforts(activity, inputs, distances):
+    cumulative_distance = inputs['effort_distance']
+    seconds = inputs['seconds']
+    best_efforts = {}
+    for name, distance in distances.items():
+        targets = cumulative_distance + distance
+        ends = np.searchsorted(cumulative_distance, targets)
+        valid = ends < len(cumulative_distance)
+        if not valid.any():
+            best_efforts[name] = None
+            continue
+        starts = np.nonzero(valid)[0]
+        ends = ends[valid]
+        covered = cumulative_distance[ends] - cumulative_distance[ends - 1]
+        fraction = np.divide(targets[valid] - cumulative_distance[ends - 1], covered,
+                             out=np.ones_like(covered), where=covered > 0)
+        end_times = seconds[ends - 1] + (seconds[ends] - seconds[ends - 1]) * fraction
+        best_efforts[name] = float((end_times - seconds[starts]).min())
+    return best_efforts
@@ -0,0 +1,135 @@
+# Rollup - Pre-aggregated Weekly, Monthly and Yearly Training Totals
+#
+# This module defines the ActivityRollup class, which maintains pre-aggregated totals of an athlete's
+# activities grouped by ISO week, month and year. Totals include distance, duration, elevation gain,
+# time spent in each heart rate zone and number of activities.
+#
+# Copyright (C) 2023 Salvatore D'Angelo
+# Maintainer: Salvatore D'Angelo sasadangelo@gmail.com
+#
+# This file is part of the Running Data Analysis project.
+#
+# SPDX-License-Identifier: MIT
+import os
+import json
+from datetime import datetime
+from src.lib.activity import METRICS_VERSION
+
+# The periods supported by the rollup. Each period is mapped to a function that,
+# given the activity start time, returns the key of the bucket the activity belongs to.
+PERIODS = {
+    'week': lambda time: f'{time.isocalendar()[0]}-W{time.isocalendar()[1]:02d}',
+    'month': lambda time: time.strftime('%Y-%m'),
+    'year': lambda time: time.strftime('%Y'),
+}
+
+# The metrics accumulated in each bucket. The 'zones' metric is a list with the seconds
+# spent in each heart rate zone (see Activity.get_time_in_zones).
+METRICS = ['distance', 'duration', 'elevation_gain', 'count']
+NUMBER_OF_ZONES = 5
+
+# This class maintains pre-aggregated totals of the athlete activities. Buckets are updated
+# incrementally when an activity is added or removed, so the totals for a given week, month or year
+# can be read in constant time without loading any Activity. The contribution of each activity is
+# stored as well, so that removing an activity only subtracts its own values from the buckets.
+#
+# The rollup can be persisted to a JSON file and reloaded later.
+class ActivityRollup:
+    def __init__(self, max_heart_rate=None):
+        # The maximum heart rate used to compute the heart rate zones
+        self.max_heart_rate = max_heart_rate
+        # The contribution of each activity, keyed by activity id
+        self.activities = {}
+        # The aggregated totals: period -> bucket key -> totals
+        self.buckets = {period: {} for period in PERIODS}
+
+    # Loads the rollup from the input JSON file. If the file does not exist an empty rollup is returned.
+    @classmethod
+    def load(cls, rollup_path, max_heart_rate=None):
+        rollup = cls(max_heart_rate)
+        if os.path.exists(rollup_path):
+            with open(rollup_path, 'r') as rollup_file:
+                data = json.load(rollup_file)
+            # Heart rate zones computed with a different maximum heart rate are not comparable, and totals computed
+            # with a different METRICS_VERSION neither, in that case the rollup is discarded and it will be rebuilt
+            # from the activities.
+            same_version = data.get('version') == METRICS_VERSION
+            if same_version and (max_heart_rate is None or data.get('max_heart_rate') == max_heart_rate):
+                rollup.max_heart_rate = data.get('max_heart_rate')
+                rollup.activities = data['activities']
+                rollup.buckets = data['buckets']
+        return rollup
+
+    # Saves the rollup to the input JSON file.
+    def save(self, rollup_path):
+        data = {
+            'version': METRICS_VERSION,
+            'max_heart_rate': self.max_heart_rate,
+            'activities': self.activities,
+            'buckets': self.buckets
+        }
+        with open(rollup_path, 'w') as rollup_file:
+            json.dump(data, rollup_file)
+
+    # Returns True if the activity with the input id is already part of the rollup.
+    def contains(self, activity_id):
+        return activity_id in self.activities
+
+    # Returns the ids of all the activities that are part of the rollup.
+    def get_activity_ids(self):
+        return list(self.activities.keys())
+
+    # Adds the activity to the rollup. If an activity with the same id is already present
+    # it is replaced.
+    def add_activity(self, activity_id, activity):
+        if activity_id in self.activities:
+            self.remove_activity(activity_id)
+
+        zones = [0] * NUMBER_OF_ZONES
+        if self.max_heart_rate is not None:
+            zones = activity.get_time_in_zones(self.max_heart_rate)
+
+        contribution = {
+            'time': activity.get_time().isoformat(),
+            'distance': activity.get_distance(),
+            'duration': activity.get_duration(),
+            'elevation_gain': activity.get_elevation_gain() or 0,
+            'count': 1,
+            'zones': zones
+        }
+        self.activities[activity_id] = contribution
+        self.__apply(contribution, 1)
+
+    # Removes the activity with the input id from the rollup. Nothing happens if it is not present.
+    def remove_activity(self, activity_id):
+        contribution = self.activities.pop(activity_id, None)
+        if contribution is not None:
+            self.__apply(contribution, -1)
+
+    # Returns the totals of the bucket with the input key (e.g. '2023-W36', '2023-09' or '2023')
+    # for the input period, or None if there are no activities in that bucket.
+    def get(self, period, key):
+        return self.buckets[period].get(key)
+
+    # Returns all the buckets of the input period sorted by key.
+    def get_buckets(self, period):
+        return dict(sorted(self.buckets[period].items()))
+
+    # Adds (sign = 1) or subtracts (sign = -1) the activity contribution to all the buckets it belongs to.
+    # Buckets that no longer contain activities are dropped.
+    def __apply(self, contribution, sign):
+        time = datetime.fromisoformat(contribution['time'])
+        for period, bucket_key in PERIODS.items():
+            key = bucket_key(time)
+            bucket = self.buckets[period].setdefault(key, self.__empty_bucket())
+            for metric in METRICS:
+                bucket[metric] += sign * contribution[metric]
+            bucket['zones'] = [total + sign * value for total, value in zip(bucket['zones'], contribution['zones'])]
+            if bucket['count'] <= 0:
+                del self.buckets[period][key]
+
+    # Returns a bucket with all the totals set to zero.
+    def __empty_bucket(self):
+        bucket = {metric: 0 for metric in METRICS}
+        bucket['zones'] = [0] * NUMBER_OF_ZONES
+        return bucket
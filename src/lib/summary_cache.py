@@ -0,0 +1,72 @@
+# SummaryCache - Cache of Activity Summaries
+#
+# This module defines the ActivitySummaryCache class, which stores on disk what the application needs to know
+# about each GPX file (overview row, content hash and fingerprint) so that, once cached, the activities can be
+# listed without importing the GPX parsing libraries and without parsing any file.
+#
+# Copyright (C) 2023 Salvatore D'Angelo
+# Maintainer: Salvatore D'Angelo sasadangelo@gmail.com
+#
+# This file is part of the Running Data Analysis project.
+#
+# SPDX-License-Identifier: MIT
+import os
+import json
+from src.lib.activity import METRICS_VERSION
+
+# This class is a persistent dictionary from GPX file name to the summary of the activity. Each entry records the
+# size and modification time of the file it was computed from: if the file changes the entry is no longer valid and
+# the file must be parsed again. The cache is saved to a JSON file only if it has been modified. A cache written with
+# a different METRICS_VERSION is discarded, its summaries were computed with different algorithms.
+class ActivitySummaryCache:
+    def __init__(self, cache_path):
+        self.cache_path = cache_path
+        self.entries = {}
+        self.modified = False
+        if os.path.exists(cache_path):
+            try:
+                with open(cache_path, 'r') as cache_file:
+                    data = json.load(cache_file)
+                if data.get('version') == METRICS_VERSION:
+                    self.entries = data['entries']
+                else:
+                    self.modified = True
+            except (OSError, ValueError, AttributeError, KeyError):
+                # a corrupted cache is rebuilt from the GPX files
+                self.entries = {}
+                self.modified = True
+
+    # Returns the cached summary of the input GPX file, or None if it is not cached or the file has changed.
+    def get(self, file_path):
+        entry = self.entries.get(os.path.basename(file_path))
+        if entry is not None and entry['stat'] == self.__get_stat(file_path):
+            return entry['summary']
+        return None
+
+    # Stores the summary (a JSON serializable dictionary) of the input GPX file.
+    def put(self, file_path, summary):
+        self.entries[os.path.basename(file_path)] = {'stat': self.__get_stat(file_path), 'summary': summary}
+        self.modified = True
+
+    # Removes the entry of the input GPX file. Nothing happens if it is not cached.
+    def remove(self, file_path):
+        if self.entries.pop(os.path.basename(file_path), None) is not None:
+            self.modified = True
+
+    # Removes the entries of the files not in the input list of file names.
+    def retain(self, filenames):
+        for filename in set(self.entries) - set(filenames):
+            del self.entries[filename]
+            self.modified = True
+
+    # Saves the cache to disk if it has been modified.
+    def save(self):
+        if self.modified:
+            with open(self.cache_path, 'w') as cache_file:
+                json.dump({'version': METRICS_VERSION, 'entries': self.entries}, cache_file)
+            self.modified = False
+
+    # Returns the size and modification time of the file.
+    def __get_stat(self, file_path):
+        stat = os.stat(file_path)
+        return [stat.st_size, stat.st_mtime_ns]
@@ -12,7 +12,6 @@
 # SPDX-License-Identifier: MIT
 import streamlit as st
 import pandas as pd
-from src.lib.activity import Activity
 from src.ui.page import Page
 
 # This class is responsible for displaying an overview of running activities using Streamlit.
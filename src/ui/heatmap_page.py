@@ -0,0 +1,50 @@
+# HeatmapPage - Display the Heatmap of the Athlete's Routes
+#
+# This class is responsible for displaying a heatmap of everywhere the athlete has run. The page reads the
+# precomputed tiles of the heatmap tile pyramid, only new activities are rasterized before showing it.
+#
+# Copyright (C) 2023 Salvatore D'Angelo
+# Maintainer: Salvatore D'Angelo sasadangelo@gmail.com
+#
+# This file is part of the Running Data Analysis project.
+#
+# SPDX-License-Identifier: MIT
+import os
+import streamlit as st
+from src.lib.heatmap import HeatmapTiles
+from src.ui.page import Page
+
+# Maximum number of tiles composed in the displayed image
+MAX_TILES = 64
+
+# This class is responsible for displaying the heatmap of the athlete's routes.
+# The page shows, at the selected zoom level, the tiles covering all the activities.
+class HeatmapPage(Page):
+    # Renders the heatmap page
+    def render(self):
+        st.title("Heatmap")
+
+        # the session contains the logged in athlete
+        athlete = st.session_state.logged_in_user
+        if not athlete:
+            st.warning("You must login to visualize the heatmap.")
+            return
+
+        heatmap = HeatmapTiles(os.path.join("data", athlete.get_username(), 'heatmap'))
+        # the activities not yet in the heatmap are rasterized, the others are already in the tiles
+        with st.spinner("Updating the heatmap tiles..."):
+            heatmap.update(athlete.get_activity_files())
+
+        zoom = st.slider("Zoom", heatmap.min_zoom, heatmap.max_zoom, 13)
+        tile_range = heatmap.get_tile_range(zoom)
+        if tile_range is None:
+            st.warning("No activities found.")
+            return
+
+        min_x, min_y, max_x, max_y = tile_range
+        tiles = (max_x - min_x + 1) * (max_y - min_y + 1)
+        if tiles > MAX_TILES:
+            st.warning(f"The activities cover {tiles} tiles at zoom {zoom}, choose a lower zoom level.")
+            return
+
+        st.image(heatmap.compose(zoom, tile_range), use_column_width=True)
@@ -9,6 +9,8 @@
 #
 # SPDX-License-Identifier: MIT
 import streamlit as st
+import pandas as pd
+from src.lib.best_efforts import STANDARD_DISTANCES
 from src.ui.page import Page
 
 # This class is responsible for displaying the athlete's profile.
@@ -19,6 +21,7 @@ from src.ui.page import Page
 # - Gender
 # - Location
 # - Bio
+# - Personal bests (all-time and last 90 days) and race time predictions for each standard distance
 class ProfilePage(Page):
     # Renders the profile page
     def render(self):
@@ -38,10 +41,39 @@ class ProfilePage(Page):
             st.write(f"Gender: {athlete.get_gender()}")
             st.write(f"Location: {athlete.get_location()}")
             st.write(f"Bio: {athlete.get_bio()}")
+            self.__render_best_efforts(athlete)
         else:
             st.warning("You must login to visualize the profile.")
 
+    # Renders the personal bests and the race time predictions. They are read from the athlete best efforts index,
+    # no activity is loaded.
+    def __render_best_efforts(self, athlete):
+        best_efforts = athlete.get_best_efforts()
+        predictor = athlete.get_race_predictor()
+        rows = []
+        for name in STANDARD_DISTANCES:
+            all_time_best = best_efforts.get_all_time_best(name)
+            rolling_best = best_efforts.get_rolling_best(name)
+            rows.append([
+                name,
+                self.__format_time(all_time_best[1] if all_time_best else None),
+                all_time_best[0][:10] if all_time_best else None,
+                self.__format_time(rolling_best[1] if rolling_best else None),
+                self.__format_time(predictor.predict_riegel(name)),
+                self.__format_time(predictor.predict_critical_speed(name))
+            ])
+        columns = ['Distance', 'Personal Best', 'Date', 'Last 90 Days', 'Riegel Prediction', 'Critical Speed Prediction']
 
+        st.subheader("Personal Bests and Race Predictions")
+        st.dataframe(pd.DataFrame(rows, columns=columns), hide_index=True)
+        critical_speed, d_prime = predictor.get_critical_speed()
+        if critical_speed:
+            st.write(f"Critical Speed: {self.__format_time(1000 / critical_speed)}/km, D': {d_prime:.0f} m")
 
-
-
+    # Converts seconds to the 'H:MM:SS' format, or '-' if they are None.
+    def __format_time(self, seconds):
+        if seconds is None:
+            return '-'
+        hours, remainder = divmod(int(round(seconds)), 3600)
+        minutes, seconds = divmod(remainder, 60)
+        return f'{hours}:{minutes:02d}:{seconds:02d}' if hours else f'{minutes}:{seconds:02d}'
@@ -0,0 +1,70 @@
+# SummaryPage - Display Athlete's Weekly, Monthly and Yearly Totals
+#
+# This class is responsible for displaying the athlete's training totals grouped by week, month or year
+# using Streamlit charts. It reads only the pre-aggregated totals of the athlete rollup, no activity is loaded.
+#
+# Copyright (C) 2023 Salvatore D'Angelo
+# Maintainer: Salvatore D'Angelo sasadangelo@gmail.com
+#
+# This file is part of the Running Data Analysis project.
+#
+# SPDX-License-Identifier: MIT
+import streamlit as st
+import pandas as pd
+from src.ui.page import Page
+
+# This class is responsible for displaying the athlete's training totals.
+# The page will show, for the selected period (week, month or year), charts with:
+# - Distance
+# - Duration
+# - Elevation gain
+# - Number of activities
+# - Time spent in each heart rate zone
+class SummaryPage(Page):
+    # Renders the summary page
+    def render(self):
+        st.title("Training Summary")
+
+        # the session contains the logged in athlete
+        athlete = st.session_state.logged_in_user
+        if not athlete:
+            st.warning("You must login to visualize the summary.")
+            return
+
+        period = st.radio("Group by", ["week", "month", "year"], horizontal=True)
+        buckets = athlete.get_rollup().get_buckets(period)
+        if not buckets:
+            st.warning("No activities found.")
+            return
+
+        df = self.__create_dataframe(buckets)
+        self.__display_charts(df)
+
+    # Creates a pandas DataFrame, indexed by bucket key, from the rollup buckets.
+    def __create_dataframe(self, buckets):
+        rows = []
+        for key, totals in buckets.items():
+            row = {
+                'Period': key,
+                'Distance (Km)': round(totals['distance'], 2),
+                'Duration (h)': round(totals['duration'] / 3600, 2),
+                'Elev. Gain (m)': round(totals['elevation_gain'], 1),
+                'Activities': totals['count']
+            }
+            for zone, seconds in enumerate(totals['zones'], start=1):
+                row[f'Z{zone} (min)'] = round(seconds / 60, 1)
+            rows.append(row)
+        return pd.DataFrame(rows).set_index('Period')
+
+    # Displays the totals as Streamlit charts.
+    def __display_charts(self, df):
+        st.subheader("Distance (Km)")
+        st.bar_chart(df['Distance (Km)'])
+        st.subheader("Duration (h)")
+        st.bar_chart(df['Duration (h)'])
+        st.subheader("Elevation Gain (m)")
+        st.bar_chart(df['Elev. Gain (m)'])
+        st.subheader("Activities")
+        st.bar_chart(df['Activities'])
+        st.subheader("Time in Heart Rate Zones (min)")
+        st.bar_chart(df[[column for column in df.columns if column.startswith('Z')]])
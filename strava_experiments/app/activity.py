@@ -0,0 +1,67 @@
+from . import db
+
+class Activity(db.Model):
+    __tablename__ = "activity"
+    __table_args__ = (
+        db.Index('ix_activity_athlete_start_time', 'athlete_id', 'start_time'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    athlete_id = db.Column(db.Integer, db.ForeignKey('athlete.id'), nullable=False)
+    start_time = db.Column(db.DateTime, nullable=False)
+    name = db.Column(db.String(100))
+    description = db.Column(db.Text)
+    source_file = db.Column(db.String(255), nullable=False)
+    # The data samples stored column by column as gzip compressed JSON, see activity_import.py
+    stream = db.Column(db.LargeBinary)
+    stream_etag = db.Column(db.String(64))
+    summary = db.relationship('ActivitySummary', backref='activity', uselist=False, cascade='all, delete-orphan')
+
+    def to_json(self):
+        return {
+            'id': self.id,
+            'athlete_id': self.athlete_id,
+            'start_time': self.start_time.isoformat(),
+            'name': self.name,
+            'description': self.description,
+            'source_file': self.source_file
+        }
+
+# The summary metrics of an activity. Athlete and start time are repeated from the activity, so that
+# date range queries are answered from the (athlete_id, start_time) index without joining the activity
+# table and without loading the streams.
+class ActivitySummary(db.Model):
+    __tablename__ = "activity_summary"
+    __table_args__ = (
+        db.Index('ix_activity_summary_athlete_start_time', 'athlete_id', 'start_time'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    activity_id = db.Column(db.Integer, db.ForeignKey('activity.id'), nullable=False, unique=True)
+    athlete_id = db.Column(db.Integer, db.ForeignKey('athlete.id'), nullable=False)
+    start_time = db.Column(db.DateTime, nullable=False)
+    name = db.Column(db.String(100))
+    distance = db.Column(db.Float)
+    duration = db.Column(db.Float)
+    average_pace = db.Column(db.Float)
+    average_heart_rate = db.Column(db.Integer)
+    max_heart_rate = db.Column(db.Integer)
+    average_cadence = db.Column(db.Integer)
+    max_cadence = db.Column(db.Integer)
+    elevation_gain = db.Column(db.Float)
+    elevation_loss = db.Column(db.Float)
+
+    def to_json(self):
+        return {
+            'activity_id': self.activity_id,
+            'athlete_id': self.athlete_id,
+            'start_time': self.start_time.isoformat(),
+            'name': self.name,
+            'distance': self.distance,
+            'duration': self.duration,
+            'average_pace': self.average_pace,
+            'average_heart_rate': self.average_heart_rate,
+            'max_heart_rate': self.max_heart_rate,
+            'average_cadence': self.average_cadence,
+            'max_cadence': self.max_cadence,
+            'elevation_gain': self.elevation_gain,
+            'elevation_loss': self.elevation_loss
+        }
@@ -0,0 +1,84 @@
+import gzip
+from datetime import datetime, timezone
+from .athlete_api import app
+from .athlete import Athlete
+from .activity import Activity, ActivitySummary
+from flask import jsonify, request, abort, make_response
+
+# Streams never change once imported, clients and proxies can cache them for a day
+STREAM_MAX_AGE = 86400
+MAX_PER_PAGE = 500
+
+# Parses an ISO 8601 date or datetime query parameter, aborting with 400 if it is not valid. Start times are stored
+# as naive UTC datetimes, so a value with a UTC offset is converted to UTC, a value without one is taken as UTC.
+def parse_datetime_arg(name):
+    value = request.args.get(name)
+    if value is None:
+        return None
+    try:
+        value = datetime.fromisoformat(value)
+    except ValueError:
+        abort(400)
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+# Lists the activity summaries of the athlete, most recent first. The optional 'since' and 'until'
+# parameters (ISO 8601) restrict the start time range, 'page' and 'per_page' paginate the result.
+@app.route("/athlete/<int:id>/activities", methods=["GET"])
+def get_activity_summaries(id):
+    if Athlete.query.get(id) is None:
+        abort(404)
+    page = request.args.get('page', 1, type=int)
+    per_page = min(request.args.get('per_page', 50, type=int), MAX_PER_PAGE)
+    if page < 1 or per_page < 1:
+        abort(400)
+
+    query = ActivitySummary.query.filter(ActivitySummary.athlete_id == id)
+    since = parse_datetime_arg('since')
+    if since is not None:
+        query = query.filter(ActivitySummary.start_time >= since)
+    until = parse_datetime_arg('until')
+    if until is not None:
+        query = query.filter(ActivitySummary.start_time <= until)
+
+    pagination = query.order_by(ActivitySummary.start_time.desc()).paginate(page=page, per_page=per_page, error_out=False)
+    return jsonify({
+        'items': [summary.to_json() for summary in pagination.items],
+        'page': pagination.page,
+        'per_page': pagination.per_page,
+        'total': pagination.total,
+        'pages': pagination.pages
+    })
+
+@app.route("/activity/<int:id>", methods=["GET"])
+def get_activity(id):
+    activity = Activity.query.get(id)
+    if activity is None:
+        abort(404)
+    result = activity.to_json()
+    result['summary'] = activity.summary.to_json() if activity.summary else None
+    return jsonify(result)
+
+# Returns the data samples of the activity as columnar JSON. The payload is stored gzip compressed and is
+# sent as is to the clients accepting gzip encoding. ETag and Cache-Control headers let clients skip
+# downloading streams they already have. The gzip and the decompressed bodies differ, so they have different ETags.
+@app.route("/activity/<int:id>/stream", methods=["GET"])
+def get_activity_stream(id):
+    activity = Activity.query.get(id)
+    if activity is None or activity.stream is None:
+        abort(404)
+
+    if request.accept_encodings['gzip'] > 0:
+        response = make_response(activity.stream)
+        response.headers['Content-Encoding'] = 'gzip'
+        etag = activity.stream_etag + '-gzip'
+    else:
+        response = make_response(gzip.decompress(activity.stream))
+        etag = activity.stream_etag
+    response.mimetype = 'application/json'
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.cache_control.public = True
+    response.cache_control.max_age = STREAM_MAX_AGE
+    response.set_etag(etag)
+    return response.make_conditional(request)
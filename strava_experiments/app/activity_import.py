@@ -0,0 +1,91 @@
+import os
+import sys
+import gzip
+import json
+import hashlib
+import math
+from . import db
+from .activity import Activity, ActivitySummary
+
+# The GPX parsing is shared with the Running Data Analysis application in the repository root
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from src.lib.activity import Activity as GPXActivity
+
+# The columns of the activity stream, optional columns missing in the GPX file are not included.
+STREAM_COLUMNS = ['latitude', 'longitude', 'elevation', 'hr', 'cadence']
+
+# Returns the value converted to a JSON serializable type, NaN values are converted to None.
+def _to_json_value(value):
+    if value is None:
+        return None
+    value = value.item() if hasattr(value, 'item') else value
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    return value
+
+# Returns the activity data samples as a gzip compressed columnar JSON payload:
+# {"start_time": ..., "columns": {"time": [seconds from start], "latitude": [...], ...}}
+# Storing columns instead of rows keeps the payload small and is what charting libraries expect.
+def create_stream(activity_data):
+    start_time = activity_data['time'].iloc[0]
+    columns = {'time': [_to_json_value(seconds) for seconds in (activity_data['time'] - start_time).dt.total_seconds()]}
+    for column in STREAM_COLUMNS:
+        if column in activity_data.columns:
+            columns[column] = [_to_json_value(value) for value in activity_data[column]]
+    payload = json.dumps({'start_time': start_time.isoformat(), 'columns': columns}, separators=(',', ':'))
+    return gzip.compress(payload.encode('utf-8'), mtime=0)
+
+# Parses the GPX files in the input folder and stores activities, summaries and streams of the athlete.
+# Files already imported for the athlete are skipped. Each activity is committed on its own, so the session doesn't
+# keep the streams of all the files and a failure only loses the activity that caused it.
+# Returns the number of imported activities.
+def import_activities(athlete, gpx_folder):
+    imported_files = {source_file for (source_file,) in
+                      db.session.query(Activity.source_file).filter(Activity.athlete_id == athlete.id)}
+    imported = 0
+
+    for filename in sorted(os.listdir(gpx_folder)):
+        if not filename.endswith('.gpx') or filename in imported_files:
+            continue
+        try:
+            gpx_activity = GPXActivity(os.path.join(gpx_folder, filename))
+        except Exception as e:
+            print(f"Error: {str(e)}")
+            continue
+
+        # times are stored as naive UTC datetimes
+        start_time = gpx_activity.get_time().tz_convert('UTC').tz_localize(None).to_pydatetime()
+        stream = create_stream(gpx_activity.get_activity_data())
+        activity = Activity(
+            athlete_id=athlete.id,
+            start_time=start_time,
+            name=gpx_activity.get_name(),
+            description=gpx_activity.get_description(),
+            source_file=filename,
+            stream=stream,
+            stream_etag=hashlib.sha256(stream).hexdigest()
+        )
+        activity.summary = ActivitySummary(
+            athlete_id=athlete.id,
+            start_time=start_time,
+            name=gpx_activity.get_name(),
+            distance=_to_json_value(gpx_activity.get_distance()),
+            duration=_to_json_value(gpx_activity.get_duration()),
+            average_pace=_to_json_value(gpx_activity.get_average_pace()),
+            average_heart_rate=_to_json_value(gpx_activity.get_average_heart_rate()),
+            max_heart_rate=_to_json_value(gpx_activity.get_max_heart_rate()),
+            average_cadence=_to_json_value(gpx_activity.get_average_cadence()),
+            max_cadence=_to_json_value(gpx_activity.get_max_cadence()),
+            elevation_gain=_to_json_value(gpx_activity.get_elevation_gain()),
+            elevation_loss=_to_json_value(gpx_activity.get_elevation_loss())
+        )
+        db.session.add(activity)
+        try:
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            print(f"Error: cannot import '{filename}': {str(e)}")
+            continue
+        imported += 1
+
+    return imported
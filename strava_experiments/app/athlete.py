@@ -9,6 +9,7 @@ class Athlete(db.Model):
     state = db.Column(db.String(50))
     country = db.Column(db.String(50))
     sex = db.Column(db.String(1), nullable=False)
+    activities = db.relationship('Activity', backref='athlete', lazy='dynamic', cascade='all, delete-orphan')
 
     def to_json(self):
         return {
@@ -1,6 +1,7 @@
 import os
 from . import create_app
 from .athlete import Athlete
+from .activity import Activity, ActivitySummary  # registers the activity tables created by create_all()
 from . import db
 from flask import jsonify, request, abort
 
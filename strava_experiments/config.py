@@ -1,3 +1,5 @@
+import os
+
 class Config:
     DEBUG = False
     TESTING = False
@@ -15,12 +17,17 @@ class TestingConfig(Config):
     TESTING = True
     SQLALCHEMY_DATABASE_URI = "sqlite:///test.db"
 
+# Used by the load testing harness (test/load_test.py), which runs the application against a temporary database
+class LoadTestingConfig(Config):
+    SQLALCHEMY_DATABASE_URI = os.getenv('LOADTEST_DATABASE_URI', 'sqlite:///loadtest.db')
+
 class ProductionConfig(Config):
     SQLALCHEMY_DATABASE_URI = "sqlite:///production.db"
 
 config = {
     'development': DevelopmentConfig,
     'testing': TestingConfig,
+    'loadtest': LoadTestingConfig,
     'production': ProductionConfig,
     'default': DevelopmentConfig
 }
@@ -1,7 +1,23 @@
+import click
 from app import db
 from app.athlete_api import app
 from app.athlete import Athlete 
+from app.activity import Activity, ActivitySummary
+from app.activity_import import import_activities
+from app import activity_api  # registers the activity routes
 
 @app.shell_context_processor
 def make_shell_context():
-    return dict(db=db, Athlete=Athlete)
+    return dict(db=db, Athlete=Athlete, Activity=Activity, ActivitySummary=ActivitySummary)
+
+# Imports the GPX files in the folder as activities of the athlete, e.g.:
+# flask import-activities 1 ../data/sasadangelo/gpx
+@app.cli.command("import-activities")
+@click.argument("athlete_id", type=int)
+@click.argument("gpx_folder")
+def import_activities_command(athlete_id, gpx_folder):
+    athlete = Athlete.query.get(athlete_id)
+    if athlete is None:
+        raise click.ClickException(f"Athlete {athlete_id} not found")
+    imported = import_activities(athlete, gpx_folder)
+    click.echo(f"Imported {imported} activities")
@@ -0,0 +1 @@
+curl --compressed -i http://localhost:5000/activity/$1/stream
@@ -0,0 +1 @@
+curl "http://localhost:5000/athlete/$1/activities?since=$2&until=$3&page=${4:-1}"
@@ -0,0 +1,281 @@
+import os
+import sys
+import json
+import math
+import time
+import random
+import socket
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+import urllib.error
+import urllib.request
+from datetime import datetime, timezone
+
+# Load testing harness for the athlete REST API (athlete_api.py).
+#
+# It starts the Flask application of running.py against a temporary SQLite database, seeds it with synthetic
+# athletes, then drives concurrent mixed traffic (list, get, create, update, delete) for a fixed time window and
+# reports throughput, p50/p95/p99 latency, error rate and timeout rate of each operation. Throughput only counts the
+# requests completed within the window, requests still in flight at the end don't stretch it. Results are written as
+# JSON so that two runs, e.g. before and after a change to athlete_api.py or config.py, can be compared with
+# --compare.
+#
+# Usage (from the strava_experiments folder):
+#   python test/load_test.py --athletes 1000 --concurrency 16 --duration 30 --output after.json --compare before.json
+
+APP_FOLDER = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+# Default weight of each operation in the traffic mix
+DEFAULT_MIX = 'list=10,get=60,create=10,update=15,delete=5'
+
+FIRST_NAMES = ['Salvatore', 'Maria', 'Giuseppe', 'Anna', 'Francesco', 'Giulia', 'Marco', 'Sara']
+LAST_NAMES = ['Rossi', 'Bianchi', 'Esposito', 'Romano', 'Colombo', 'Ricci', 'Greco', 'Bruno']
+CITIES = [('Roma', 'Lazio'), ('Fiumicino', 'Lazio'), ('Milano', 'Lombardia'), ('Napoli', 'Campania')]
+
+# Returns a free TCP port on localhost.
+def get_free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+# Returns the JSON of a synthetic athlete.
+def synthetic_athlete(rng, id=None):
+    city, state = rng.choice(CITIES)
+    return {
+        'id': id,
+        'firstname': rng.choice(FIRST_NAMES),
+        'lastname': rng.choice(LAST_NAMES),
+        'city': city,
+        'state': state,
+        'country': 'Italia',
+        'sex': rng.choice('MF')
+    }
+
+# Sends an HTTP request and returns the status code and the decoded JSON body (None if there is none).
+# Raises TimeoutError if the server doesn't answer within the timeout.
+def send(base_url, method, path, body=None, timeout=30):
+    data = json.dumps(body).encode('utf-8') if body is not None else None
+    request = urllib.request.Request(base_url + path, data=data, method=method,
+                                     headers={'Content-Type': 'application/json'})
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            payload = response.read()
+            return response.status, json.loads(payload) if payload else None
+    except urllib.error.HTTPError as e:
+        e.read()
+        return e.code, None
+    except urllib.error.URLError as e:
+        if isinstance(e.reason, TimeoutError):
+            raise TimeoutError(str(e.reason)) from e
+        raise
+
+# Runs the Flask application of running.py in a separate process against the input database.
+class ApiServer:
+    def __init__(self, database_path, port):
+        self.database_path = database_path
+        self.port = port
+        self.base_url = f'http://127.0.0.1:{port}'
+        self.process = None
+
+    def start(self, timeout=30):
+        env = dict(os.environ, FLASK_APP='running.py', FLASK_CONFIG='loadtest',
+                   LOADTEST_DATABASE_URI='sqlite:///' + self.database_path)
+        self.process = subprocess.Popen([sys.executable, '-m', 'flask', 'run', '--port', str(self.port),
+                                         '--with-threads'],
+                                        cwd=APP_FOLDER, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"The API server exited: {self.process.stderr.read().decode()}")
+            try:
+                send(self.base_url, 'GET', '/athlete/list')
+                return
+            except (urllib.error.URLError, ConnectionError):
+                time.sleep(0.2)
+        raise RuntimeError("The API server didn't start in time")
+
+    def stop(self):
+        if self.process is not None:
+            self.process.terminate()
+            self.process.wait(timeout=10)
+
+# Drives the traffic of one client thread and records the latency and the outcome of each request:
+# 'ok', 'error' (unexpected status or failed request) or 'timeout'.
+# The ids of the existing athletes are shared by all the clients, so that get, update and delete
+# target athletes that exist (unless a concurrent client deleted them in the meantime).
+class LoadGenerator:
+    def __init__(self, base_url, mix, athlete_ids, seed, timeout):
+        self.base_url = base_url
+        self.timeout = timeout
+        self.operations = list(mix.keys())
+        self.weights = list(mix.values())
+        self.athlete_ids = athlete_ids
+        self.lock = threading.Lock()
+        self.seed = seed
+        # operation -> list of (latency in seconds, outcome, completed within the window)
+        self.samples = {operation: [] for operation in self.operations}
+
+    def run_client(self, client, deadline):
+        rng = random.Random(self.seed + client)
+        samples = {operation: [] for operation in self.operations}
+        while time.monotonic() < deadline:
+            operation = rng.choices(self.operations, self.weights)[0]
+            start = time.perf_counter()
+            try:
+                outcome = 'ok' if getattr(self, '_' + operation)(rng) else 'error'
+            except TimeoutError:
+                outcome = 'timeout'
+            except Exception:
+                outcome = 'error'
+            samples[operation].append((time.perf_counter() - start, outcome, time.monotonic() <= deadline))
+        with self.lock:
+            for operation, operation_samples in samples.items():
+                self.samples[operation].extend(operation_samples)
+
+    def __pick_id(self, rng):
+        with self.lock:
+            return rng.choice(self.athlete_ids) if self.athlete_ids else None
+
+    def _list(self, rng):
+        status, _ = send(self.base_url, 'GET', '/athlete/list', timeout=self.timeout)
+        return status == 200
+
+    def _get(self, rng):
+        id = self.__pick_id(rng)
+        status, _ = send(self.base_url, 'GET', f'/athlete/{id}', timeout=self.timeout)
+        return status == 200
+
+    def _create(self, rng):
+        status, athlete = send(self.base_url, 'POST', '/athlete', synthetic_athlete(rng), self.timeout)
+        if status == 201:
+            with self.lock:
+                self.athlete_ids.append(athlete['id'])
+        return status == 201
+
+    def _update(self, rng):
+        id = self.__pick_id(rng)
+        status, _ = send(self.base_url, 'PUT', f'/athlete/{id}', synthetic_athlete(rng, id), self.timeout)
+        return status == 200
+
+    def _delete(self, rng):
+        with self.lock:
+            if not self.athlete_ids:
+                return False
+            id = self.athlete_ids.pop(rng.randrange(len(self.athlete_ids)))
+        status, _ = send(self.base_url, 'DELETE', f'/athlete/{id}', timeout=self.timeout)
+        return status == 200
+
+# Returns the value at the input percentile (0-100) of the sorted list, nearest rank method.
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    rank = max(0, min(len(sorted_values) - 1, math.ceil(p / 100 * len(sorted_values)) - 1))
+    return sorted_values[rank]
+
+# Summarizes a list of (latency, outcome, in window) samples of a test window of the input seconds. Throughput counts
+# the requests completed within the window, latencies (in milliseconds) don't include the timed out requests, which
+# are reported by the timeout rate.
+def summarize(samples, window):
+    latencies = sorted(latency * 1000 for latency, outcome, _ in samples if outcome != 'timeout')
+    completed = sum(1 for _, outcome, in_window in samples if in_window and outcome != 'timeout')
+    errors = sum(1 for _, outcome, _ in samples if outcome == 'error')
+    timeouts = sum(1 for _, outcome, _ in samples if outcome == 'timeout')
+    return {
+        'requests': len(samples),
+        'throughput': completed / window if window else 0,
+        'p50_ms': percentile(latencies, 50),
+        'p95_ms': percentile(latencies, 95),
+        'p99_ms': percentile(latencies, 99),
+        'error_rate': errors / len(samples) if samples else 0,
+        'timeout_rate': timeouts / len(samples) if samples else 0
+    }
+
+def parse_mix(value):
+    mix = {}
+    for item in value.split(','):
+        operation, weight = item.split('=')
+        if operation not in ('list', 'get', 'create', 'update', 'delete'):
+            raise argparse.ArgumentTypeError(f"unknown operation '{operation}'")
+        mix[operation] = float(weight)
+    return mix
+
+# Prints a table of the results and, if a baseline is given, the relative change of each measure.
+def print_report(results, baseline):
+    measures = ['requests', 'throughput', 'p50_ms', 'p95_ms', 'p99_ms', 'error_rate', 'timeout_rate']
+    print(f"{'operation':<10}" + ''.join(f'{measure:>20}' for measure in measures))
+    for operation, summary in results['operations'].items():
+        row = f'{operation:<10}'
+        for measure in measures:
+            value = summary[measure]
+            cell = '-' if value is None else f'{value:.2f}'
+            base = baseline['operations'].get(operation, {}).get(measure) if baseline else None
+            if base and value is not None:
+                cell += f' ({(value - base) / base:+.0%})'
+            row += f'{cell:>20}'
+        print(row)
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test the athlete REST API')
+    parser.add_argument('--athletes', type=int, default=500, help='number of synthetic athletes seeded')
+    parser.add_argument('--concurrency', type=int, default=8, help='number of concurrent clients')
+    parser.add_argument('--duration', type=float, default=20, help='duration of the test in seconds')
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix(DEFAULT_MIX),
+                        help=f'weights of the operations (default: {DEFAULT_MIX})')
+    parser.add_argument('--seed', type=int, default=42, help='random seed, for repeatable traffic')
+    parser.add_argument('--timeout', type=float, default=30, help='timeout of each request in seconds')
+    parser.add_argument('--output', help='file where the JSON results are written')
+    parser.add_argument('--compare', help='JSON results of a previous run to compare with')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as database_folder:
+        server = ApiServer(os.path.join(database_folder, 'loadtest.db'), get_free_port())
+        server.start()
+        try:
+            rng = random.Random(args.seed)
+            athlete_ids = []
+            for _ in range(args.athletes):
+                status, athlete = send(server.base_url, 'POST', '/athlete', synthetic_athlete(rng))
+                if status != 201:
+                    raise RuntimeError(f"Seeding failed with status {status}")
+                athlete_ids.append(athlete['id'])
+
+            generator = LoadGenerator(server.base_url, args.mix, athlete_ids, args.seed, args.timeout)
+            deadline = time.monotonic() + args.duration
+            clients = [threading.Thread(target=generator.run_client, args=(client, deadline))
+                       for client in range(args.concurrency)]
+            for client in clients:
+                client.start()
+            for client in clients:
+                client.join()
+            # time spent waiting for the requests in flight at the end of the window
+            drain = max(0.0, time.monotonic() - deadline)
+        finally:
+            server.stop()
+
+    all_samples = [sample for samples in generator.samples.values() for sample in samples]
+    results = {
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'parameters': {'athletes': args.athletes, 'concurrency': args.concurrency,
+                       'duration': args.duration, 'mix': args.mix, 'seed': args.seed, 'timeout': args.timeout},
+        'window': args.duration,
+        'drain': drain,
+        'operations': {operation: summarize(samples, args.duration)
+                       for operation, samples in generator.samples.items()}
+    }
+    results['operations']['total'] = summarize(all_samples, args.duration)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, 'r') as baseline_file:
+            baseline = json.load(baseline_file)
+    print_report(results, baseline)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(results, output_file, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+# Regression tests of the activity cleaning, on the sample activities with wrong timestamps.
+#
+# Copyright (C) 2023 Salvatore D'Angelo
+# Maintainer: Salvatore D'Angelo sasadangelo@gmail.com
+#
+# This file is part of the Running Data Analysis project.
+#
+# SPDX-License-Identifier: MIT
+import re
+import pytest
+from src.lib.activity import Activity
+from src.lib.chunked_activity import ChunkedActivity
+
+GPX_FILE = 'data/sasadangelo/gpx/activity_20230909.gpx'
+
+# Writes a copy of GPX_FILE where the timestamps of the input trackpoints are moved one day ahead and returns its path.
+def write_glitched_file(directory, trackpoints):
+    with open(GPX_FILE) as gpx_file:
+        content = gpx_file.read()
+    times = list(re.finditer(r'<trkpt.*?<time>(\d{4}-\d{2})-(\d{2})', content, re.DOTALL))
+    for index in sorted(trackpoints, reverse=True):
+        match = times[index]
+        content = content[:match.start(2)] + f'{int(match.group(2)) + 1:02d}' + content[match.end(2):]
+    path = directory / 'glitched.gpx'
+    path.write_text(content)
+    return str(path)
+
+@pytest.mark.parametrize('trackpoints', [[300], [200, 201, 202], [-1]])
+def test_wrong_timestamps_are_dropped(tmp_path, trackpoints):
+    original = Activity(GPX_FILE)
+    activity = Activity(write_glitched_file(tmp_path, trackpoints))
+    # only the wrong samples are dropped, the 24 hours are not counted
+    assert activity.get_distance() == pytest.approx(original.get_distance(), rel=0.01)
+    assert activity.get_duration() == pytest.approx(original.get_duration(), rel=0.01)
+
+@pytest.mark.parametrize('chunk_size', [1, 7, 100, 100000])
+def test_chunked_activity_agrees_on_wrong_timestamps(tmp_path, chunk_size):
+    file_path = write_glitched_file(tmp_path, [300, 450, 451, -1])
+    activity = Activity(file_path)
+    chunked_activity = ChunkedActivity(file_path, chunk_size)
+    assert chunked_activity.get_distance() == pytest.approx(activity.get_distance())
+    assert chunked_activity.get_duration() == pytest.approx(activity.get_duration())
+    assert chunked_activity.get_average_heart_rate() == activity.get_average_heart_rate()
+    assert chunked_activity.get_elevation_gain() == pytest.approx(activity.get_elevation_gain())
+    assert chunked_activity.get_cleaning_report() == activity.get_cleaning_report()